@@ -35,10 +35,81 @@ import_parser_payload.add_argument('simple_xml', location='form',
                                    required=False, default=None,
                                    type=inputs.boolean,
                                    help=('Send xml without preprocessing.'))
+import_parser_payload.add_argument('results_include', location='form',
+                                   required=False, default=None,
+                                   action='append',
+                                   help=('Glob pattern of result file names '
+                                         'to import.'))
+import_parser_payload.add_argument('results_exclude', location='form',
+                                   required=False, default=None,
+                                   action='append',
+                                   help=('Glob pattern of files or '
+                                         'directories under results to '
+                                         'skip.'))
+import_parser_payload.add_argument('results_max_depth', location='form',
+                                   required=False, default=None, type=int,
+                                   help=('Levels of subdirectories of '
+                                         'results to search.'))
+import_parser_payload.add_argument('preflight', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Check all result files before '
+                                         'starting any launch.'))
+import_parser_payload.add_argument('stream_xml', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Parse and import xml '
+                                         'incrementally.'))
+import_parser_payload.add_argument('jobs', location='form',
+                                   required=False, default=None, type=int,
+                                   help=('Number of result files to import '
+                                         'in parallel.'))
+import_parser_payload.add_argument('shards', location='form',
+                                   required=False, default=None, type=int,
+                                   help=('Number of workers reporting the '
+                                         'testcases of a single testsuite '
+                                         'in parallel.'))
+import_parser_payload.add_argument('pipeline', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Run parsing, transforming and '
+                                         'uploading as concurrent stages.'))
+import_parser_payload.add_argument('queue_size', location='form',
+                                   required=False, default=None, type=int,
+                                   help=('Maximum items queued between '
+                                         'pipeline stages.'))
+import_parser_payload.add_argument('output_spill_size', location='form',
+                                   required=False, default=None, type=int,
+                                   help=('Characters of a system-out/'
+                                         'system-err logged before it is '
+                                         'sent as a compressed attachment '
+                                         '(0 to disable).'))
+import_parser_payload.add_argument('durations_description',
+                                   location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Add a test duration summary to the '
+                                         'launch description.'))
+import_parser_payload.add_argument('compact_passed', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Report the passed testcases of '
+                                         'each testsuite as one item.'))
+import_parser_payload.add_argument('resume', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Continue interrupted imports from '
+                                         'their journals.'))
 import_parser_payload.add_argument("merge_launches", location='form',
                                    required=False, default=None,
                                    type=inputs.boolean,
                                    help="Merge multiple launches into one.")
+import_parser_payload.add_argument('single_launch', location='form',
+                                   required=False, default=None,
+                                   type=inputs.boolean,
+                                   help=('Import all result files into one '
+                                         'launch, each file as a top-level '
+                                         'suite.'))
 import_parser_payload.add_argument("auto_dashboard", location='form',
                                    required=False, default=None,
                                    type=inputs.boolean,
@@ -24,6 +24,7 @@ from flask import Flask, Blueprint
 from rp_preproc import settings
 from rp_preproc.api.process.endpoints.process_payload import payload_namespace
 from rp_preproc.api.restplus import api
+from rp_preproc.libs.sessions import SESSIONS
 
 
 app = Flask(__name__)
@@ -38,6 +39,10 @@ app.config['RESTPLUS_VALIDATE'] = settings.RESTPLUS_VALIDATE
 app.config['RESTPLUS_MASK_SWAGGER'] = settings.RESTPLUS_MASK_SWAGGER
 app.config['ERROR_404_HELP'] = settings.RESTPLUS_ERROR_404_HELP
 
+# every worker counts against the same ReportPortal budget
+SESSIONS.set_rate_limit(settings.RATE_LIMIT_DB, rate=settings.RATE_LIMIT_RPS,
+                        max_concurrent=settings.RATE_LIMIT_CONCURRENT)
+
 blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
 api.init_app(blueprint)
 api.add_namespace(payload_namespace)
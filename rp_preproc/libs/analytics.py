@@ -0,0 +1,145 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Test duration analytics computed at import time"""
+from array import array
+import heapq
+import math
+
+import numpy as np
+
+
+# upper bounds (seconds) of the duration histogram buckets
+HISTOGRAM_BINS = [0, 0.1, 1, 10, 60, 300, 3600, math.inf]
+
+
+def summarize(times, suite_index, suite_names, slowest):
+    """Build a duration summary with vectorized operations
+
+    Args:
+        times (ndarray): testcase durations in seconds (NaN if unknown)
+        suite_index (ndarray): testsuite index of each testcase (-1: none)
+        suite_names (list): testsuite names by index
+        slowest (list): (time, name) tuples of the slowest testcases
+
+    Returns:
+        dict summary
+    """
+    known = ~np.isnan(times)
+    known_times = times[known]
+    summary = {'testcases': int(times.size),
+               'timed': int(known_times.size),
+               'total': round(float(known_times.sum()), 3)}
+
+    if known_times.size:
+        p50, p95, p99 = np.percentile(known_times, [50, 95, 99])
+        summary.update({'p50': round(float(p50), 3),
+                        'p95': round(float(p95), 3),
+                        'p99': round(float(p99), 3),
+                        'max': round(float(known_times.max()), 3)})
+
+    in_suite = known & (suite_index >= 0)
+    suite_totals = np.bincount(suite_index[in_suite],
+                               weights=times[in_suite],
+                               minlength=len(suite_names))
+    suite_counts = np.bincount(suite_index[suite_index >= 0],
+                               minlength=len(suite_names))
+    summary['suites'] = [{'name': name,
+                          'testcases': int(suite_counts[index]),
+                          'total': round(float(suite_totals[index]), 3)}
+                         for index, name in enumerate(suite_names)]
+
+    counts, _ = np.histogram(known_times, bins=HISTOGRAM_BINS)
+    summary['histogram'] = {
+        '<{}s'.format(upper) if upper != math.inf
+                            else '>={}s'.format(HISTOGRAM_BINS[-2]):
+        int(count) for upper, count in zip(HISTOGRAM_BINS[1:], counts)}
+
+    summary['slowest'] = [{'name': name, 'time': round(tc_time, 3)}
+                          for tc_time, name in slowest]
+
+    return summary
+
+
+def describe(summary, slowest=3):
+    """One-line text version of a summary for a launch description"""
+    if 'p50' not in summary:
+        return 'Durations: no testcase times recorded'
+
+    slow = ', '.join('{} ({}s)'.format(testcase['name'], testcase['time'])
+                     for testcase in summary['slowest'][:slowest])
+
+    return ('Durations: total {total}s, p50 {p50}s, p95 {p95}s, '
+            'p99 {p99}s; slowest: {slow}'.format(slow=slow, **summary))
+
+
+class DurationStats:
+    """Duration statistics over the @time column of one result file"""
+    @staticmethod
+    def from_results(results, slowest=10):
+        """Summarize a TestResults without looping over its testcases"""
+        times = np.frombuffer(results.times, dtype=np.float64) \
+            if len(results) else np.zeros(0)
+        suite_index = np.asarray(results.suite_index, dtype=np.int64)
+
+        slowest_times = np.where(np.isnan(times), -np.inf, times)
+        count = min(slowest, times.size)
+        top = np.argpartition(slowest_times, -count)[-count:] \
+            if count else np.zeros(0, dtype=np.int64)
+        top = top[np.argsort(slowest_times[top])[::-1]]
+        top_testcases = [(float(times[index]),
+                          results.strings.get(results.names[index]))
+                         for index in top if not np.isnan(times[index])]
+
+        return summarize(times, suite_index,
+                         [suite.name for suite in results.suites],
+                         top_testcases)
+
+    def __init__(self, slowest=10):
+        """Collector for streamed imports where no TestResults is kept"""
+        self._slowest = slowest
+        self._heap = []
+        self.times = array('d')
+        self.suite_index = array('l')
+        self.suite_names = []
+
+    def add_testsuite(self, name):
+        """Register a testsuite and return its index"""
+        self.suite_names.append(name)
+
+        return len(self.suite_names) - 1
+
+    def add(self, suite, name, tc_time):
+        """Record the time of one testcase"""
+        self.suite_index.append(suite)
+        if tc_time is None:
+            self.times.append(math.nan)
+            return
+
+        self.times.append(tc_time)
+        if len(self._heap) < self._slowest:
+            heapq.heappush(self._heap, (tc_time, name))
+        elif tc_time > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (tc_time, name))
+
+    def summary(self):
+        """Summary of the collected times"""
+        times = np.frombuffer(self.times, dtype=np.float64) \
+            if self.times else np.zeros(0)
+
+        return summarize(times,
+                         np.asarray(self.suite_index, dtype=np.int64),
+                         self.suite_names,
+                         sorted(self._heap, reverse=True))
@@ -0,0 +1,556 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Index of the attachments in a payload, content-hash deduplication, size
+policies and streaming upload bodies"""
+from collections import OrderedDict
+from fnmatch import fnmatch
+import functools
+import gzip
+import hashlib
+import json
+from mimetypes import guess_type
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import uuid
+
+from glusto.core import Glusto as g
+
+
+# bytes read from an attachment at a time while it is being sent
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_ENTRIES = 10000
+# mime types besides text/* that truncate and compress like text
+TEXT_MIME_TYPES = ('application/json', 'application/xml',
+                   'application/javascript', 'application/x-sh',
+                   'application/x-yaml')
+TRUNCATED_MARKER = '\n\n[... {} bytes truncated by rp_preproc ...]\n\n'
+
+
+def guess_mime(filepath):
+    """Guess the mime type of an attachment from its name (compressed
+    files are sent as such, not as what they contain)"""
+    mime, encoding = guess_type(filepath)
+    if encoding == 'gzip':
+        return 'application/gzip'
+
+    return mime
+
+
+class AttachmentIndex:
+    """The files under a payload's attachments directory by testcase.
+
+    The tree is scanned once. Every file is listed under each directory
+    it is in, by its path below attachments_dir (<classname>.<name> or
+    <xml_name>/<classname>.<name>, with any '/' of the testcase name), so
+    the attachments of a testcase are two dict lookups instead of a walk
+    of both directories. Lookups are remembered to report the directories
+    no testcase used.
+    """
+    def __init__(self, attachments_dir):
+        self.attachments_dir = attachments_dir
+        self.files = 0
+        # 'dir', 'dir/subdir', ... -> file paths below it
+        self._index = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        if os.path.isdir(attachments_dir):
+            self._scan()
+        g.log.debug('AttachmentIndex: %s file(s) in %s director(ies) of %s',
+                    self.files, len(self._index), attachments_dir)
+
+    def _scan(self):
+        # (directory, key parts) to scan, depth first like os.walk
+        dirs = [(self.attachments_dir, ())]
+        while dirs:
+            dirpath, parts = dirs.pop()
+            subdirs = []
+            with os.scandir(dirpath) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.path, parts + (entry.name,)))
+                    elif entry.is_dir():
+                        # like os.walk, links to directories are not followed
+                        continue
+                    elif parts:
+                        self._add(parts, entry.path)
+            dirs.extend(reversed(subdirs))
+
+    def _add(self, parts, filepath):
+        self.files += 1
+        for depth in range(1, len(parts) + 1):
+            self._index.setdefault('/'.join(parts[:depth]),
+                                   []).append(filepath)
+
+    def get(self, xml_name, tc_attach_dir, count_only=False):
+        """Get the attachment files of a testcase
+
+        Args:
+            xml_name (str): name from the xml file
+            tc_attach_dir (str): testcase attachment subdirectory
+            count_only (bool): do not count the lookup as a use
+
+        Returns:
+            list of attachment file paths
+        """
+        keys = ('{}/{}'.format(xml_name, tc_attach_dir), tc_attach_dir)
+        if not count_only:
+            with self._lock:
+                self._used.update(keys)
+
+        return [filepath for key in keys
+                for filepath in self._index.get(key, [])]
+
+    def orphans(self, xml_names):
+        """Get the testcase directories no testcase used
+
+        Args:
+            xml_names (list): names of the result files, whose top-level
+                directories hold testcase directories
+        """
+        # directories holding a used one are not unused themselves
+        holding = set()
+        for key in self._used:
+            parts = key.split('/')
+            holding.update('/'.join(parts[:depth])
+                           for depth in range(1, len(parts)))
+        reported = set()
+        for key in sorted(self._index):
+            parts = key.split('/')
+            if (len(parts) == 1 and parts[0] in xml_names) or key in holding:
+                continue
+            # sorted, so a directory comes before what is in it
+            prefixes = ['/'.join(parts[:depth])
+                        for depth in range(1, len(parts) + 1)]
+            if any(prefix in self._used or prefix in reported
+                   for prefix in prefixes):
+                continue
+            reported.add(key)
+
+        return sorted(reported)
+
+
+class AttachmentDedup:
+    """Upload attachments with the same contents once.
+
+    Attachments are identified by the sha256 of their contents, computed
+    once per file. The first upload of some contents is remembered by a
+    reference (name, launch, item and link), later attachments with the
+    same contents are replaced by a log message pointing to it. With a
+    cache_file, the references of uploads that made it to ReportPortal are
+    kept across runs, least recently used ones dropped past max_entries.
+    References are scoped to the server and project they were made on.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, scope, cache_file=None,
+                 max_entries=DEFAULT_CACHE_ENTRIES):
+        """Create the dedup layer
+
+        Args:
+            scope (str): server and project the references are valid in
+            cache_file (str): JSON file keeping references between runs
+            max_entries (int): references kept in the cache file
+        """
+        self.scope = scope
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.stats = {'hashed': 0, 'uploaded': 0, 'deduplicated': 0,
+                      'from_cache': 0, 'bytes_saved': 0}
+        # scope:sha256 -> reference, least recently used first
+        self._refs = OrderedDict()
+        # references loaded from the cache file (made by earlier runs)
+        self._cached = set()
+        # file path -> sha256
+        self._digests = {}
+        self._lock = threading.Lock()
+        if cache_file is not None and os.path.exists(cache_file):
+            self._refs.update(self._read())
+            self._cached.update(self._refs)
+            g.log.debug('AttachmentDedup: %s reference(s) in %s',
+                        len(self._refs), cache_file)
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as cachefd:
+                return [(key, reference) for key, reference
+                        in json.load(cachefd)['references']]
+        except (OSError, ValueError, KeyError) as err:
+            g.log.warning('Ignoring attachment cache %s: %s',
+                          self.cache_file, err)
+
+        return []
+
+    def digest(self, filepath):
+        """Hash the contents of an attachment (once per file)"""
+        with self._lock:
+            if filepath in self._digests:
+                return self._digests[filepath]
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as attachfd:
+            for chunk in iter(lambda: attachfd.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with self._lock:
+            self.stats['hashed'] += 1
+            self._digests[filepath] = digest.hexdigest()
+
+        return self._digests[filepath]
+
+    def claim(self, filepath, reference):
+        """Claim the upload of an attachment
+
+        Args:
+            filepath (str): the attachment
+            reference (dict): name, launch, item and url of the attachment
+                if it gets uploaded
+
+        Returns:
+            (key, None) if the attachment is to be uploaded, confirm it
+            with sent(key) once it is. (key, reference) of the earlier
+            upload of the same contents otherwise.
+        """
+        key = '{}:{}'.format(self.scope, self.digest(filepath))
+        with self._lock:
+            first = self._refs.get(key)
+            if first is None:
+                self._refs[key] = dict(reference, sent=False)
+                self.stats['uploaded'] += 1
+                return key, None
+            self._refs.move_to_end(key)
+            self.stats['deduplicated'] += 1
+            self.stats['bytes_saved'] += os.path.getsize(filepath)
+            if key in self._cached:
+                self.stats['from_cache'] += 1
+
+        return key, first
+
+    def sent(self, key):
+        """Confirm the upload claimed for key is in ReportPortal"""
+        with self._lock:
+            self._refs[key]['sent'] = True
+
+    def release(self, key):
+        """Drop the claim for key, its attachment was not uploaded"""
+        with self._lock:
+            if self._refs.pop(key, None) is not None:
+                self.stats['uploaded'] -= 1
+
+    @staticmethod
+    def message(filename, reference):
+        """Log message standing in for a duplicate attachment"""
+        return '{}: same contents as attachment {} already in ' \
+            'ReportPortal: {}'.format(filename, reference['name'],
+                                      reference['url'])
+
+    def save(self):
+        """Write the confirmed references to the cache file, merged with
+        what other runs wrote to it since it was read"""
+        if self.cache_file is None:
+            return
+
+        with self._lock:
+            refs = OrderedDict(
+                (key, reference) for key, reference in self._read()
+                if key not in self._refs)
+            refs.update((key, reference)
+                        for key, reference in self._refs.items()
+                        if reference['sent'])
+        while len(refs) > self.max_entries:
+            refs.popitem(last=False)
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(self.cache_file, uuid.uuid4().hex)
+        with open(tmp_file, 'w') as cachefd:
+            json.dump({'references': list(refs.items())}, cachefd)
+        os.replace(tmp_file, self.cache_file)
+        g.log.debug('AttachmentDedup: saved %s reference(s) to %s',
+                    len(refs), self.cache_file)
+
+
+class AttachmentPolicy:
+    """Limits on what is attached to testcases.
+
+    Configured by the attachment_policy dict of the reportportal section:
+
+        max_file_bytes      largest attachment sent
+        max_testcase_bytes  bytes sent for all attachments of a testcase
+        truncate            send the head and tail of text attachments over
+                            a cap instead of skipping them (default true)
+        gzip_bytes          gzip text attachments larger than this
+        allow               mime type patterns attached (default all)
+        deny                mime type patterns never attached
+
+    Truncated and compressed copies are written to a temporary directory
+    a chunk at a time and streamed from there, removed by cleanup(). Every
+    decision is added up in stats, in files and bytes of the originals,
+    and what is sent once it is uploaded.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, config):
+        self.max_file_bytes = config.get('max_file_bytes')
+        self.max_testcase_bytes = config.get('max_testcase_bytes')
+        self.truncate = config.get('truncate', True)
+        self.gzip_bytes = config.get('gzip_bytes')
+        self.allow = config.get('allow') or ['*']
+        self.deny = config.get('deny') or []
+        self.stats = {key: 0 for key in (
+            'files', 'bytes', 'sent_files', 'sent_bytes',
+            'compressed_files', 'compressed_bytes',
+            'truncated_files', 'truncated_bytes', 'skipped_files',
+            'skipped_bytes')}
+        self._tmp_dir = None
+        self._lock = threading.Lock()
+
+    def budget(self):
+        """Bytes left for the attachments of a new testcase (None when
+        there is no cap), passed to every apply() for it"""
+        return {'bytes': self.max_testcase_bytes}
+
+    @staticmethod
+    def mime_type(filepath):
+        """Get the mime type of an attachment, sniffing unknown ones"""
+        mime = guess_mime(filepath)
+        if mime is None:
+            with open(filepath, 'rb') as attachfd:
+                sample = attachfd.read(8192)
+            mime = 'application/octet-stream' if b'\0' in sample \
+                else 'text/plain'
+
+        return mime
+
+    @staticmethod
+    def is_text(mime):
+        """Can the attachment be cut and compressed as text?"""
+        return mime.startswith('text/') or mime in TEXT_MIME_TYPES or \
+            mime.endswith(('+xml', '+json'))
+
+    def _count(self, stat, size, files=1):
+        with self._lock:
+            self.stats[stat + '_files'] += files
+            self.stats[stat + '_bytes'] += size
+
+    def apply(self, filepath, budget=None):
+        """Decide how to send an attachment
+
+        Args:
+            filepath (str): the attachment
+            budget (dict): from budget(), for the testcase's cap
+
+        Returns:
+            (path, note): the file to send (None to skip it, named like
+            the attachment, with .gz if compressed) and a note to log about
+            what was done (None if it is sent as is)
+        """
+        # pylint: disable=too-many-locals
+        filename = os.path.basename(filepath)
+        size = os.path.getsize(filepath)
+        mime = self.mime_type(filepath)
+        with self._lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+
+        if any(fnmatch(mime, pattern) for pattern in self.deny) or \
+                not any(fnmatch(mime, pattern) for pattern in self.allow):
+            self._count('skipped', size)
+            return None, \
+                '{} ({}) not attached: mime type not allowed'.format(
+                    filename, mime)
+
+        limit = self.max_file_bytes
+        left = None if budget is None else budget['bytes']
+        if left is not None and (limit is None or left < limit):
+            limit = max(left, 0)
+        text = self.is_text(mime)
+        head_tail = None
+        if limit is not None and size > limit:
+            marker_size = len(TRUNCATED_MARKER.format(size))
+            if not (text and self.truncate) or limit <= marker_size:
+                self._count('skipped', size)
+                return None, \
+                    '{} ({} bytes) not attached: over the {} byte ' \
+                    'limit'.format(filename, size, limit)
+            head = (limit - marker_size) // 2
+            head_tail = (head, limit - marker_size - head)
+        compress = text and self.gzip_bytes is not None and \
+            min(size, limit or size) > self.gzip_bytes
+
+        notes = []
+        path = filepath
+        if head_tail is not None or compress:
+            path = self._write(filepath, size, head_tail, compress)
+        if head_tail is not None:
+            cut = size - sum(head_tail)
+            self._count('truncated', cut)
+            notes.append('{} bytes truncated'.format(cut))
+        if compress:
+            written = sum(head_tail) if head_tail else size
+            saved = written - os.path.getsize(path)
+            if saved > 0:
+                self._count('compressed', saved)
+                notes.append('gzipped')
+            else:
+                # not worth it, send what was read as is
+                path = self._write(filepath, size, head_tail, False) \
+                    if head_tail else filepath
+        if budget is not None and budget['bytes'] is not None:
+            budget['bytes'] -= os.path.getsize(path)
+
+        note = None
+        if notes:
+            note = '{} ({} bytes) attached as {}: {}'.format(
+                filename, size, os.path.basename(path), ', '.join(notes))
+
+        return path, note
+
+    def sent(self, size):
+        """Count an attachment from apply() once it is uploaded"""
+        self._count('sent', size)
+
+    def _write(self, filepath, size, head_tail, compress):
+        """Write the (head and tail of the) attachment to a temporary
+        file, gzipped if compress"""
+        with self._lock:
+            if self._tmp_dir is None:
+                self._tmp_dir = tempfile.mkdtemp(prefix='rp_preproc_')
+        path = os.path.join(tempfile.mkdtemp(dir=self._tmp_dir),
+                            os.path.basename(filepath) +
+                            ('.gz' if compress else ''))
+        # no timestamp, the same attachment always compresses the same
+        opener = functools.partial(gzip.GzipFile, mtime=0) if compress \
+            else open
+        with open(filepath, 'rb') as srcfd, opener(path, 'wb') as dstfd:
+            if head_tail is None:
+                shutil.copyfileobj(srcfd, dstfd, CHUNK_SIZE)
+                return path
+            head, tail = head_tail
+            self._copy(srcfd, dstfd, head)
+            dstfd.write(TRUNCATED_MARKER.format(
+                size - head - tail).encode('utf8'))
+            srcfd.seek(size - tail)
+            self._copy(srcfd, dstfd, tail)
+
+        return path
+
+    @staticmethod
+    def _copy(srcfd, dstfd, length):
+        while length > 0:
+            chunk = srcfd.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                return
+            dstfd.write(chunk)
+            length -= len(chunk)
+
+    def cleanup(self):
+        """Remove the truncated and compressed copies (once sent)"""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+
+class MultipartStream:
+    """multipart/form-data body read from disk while it is sent.
+
+    Takes the same (field, (filename, content, mime)) list as the files
+    argument of requests, but contents that are pathlib.Path are only
+    opened once the body gets to them and read CHUNK_SIZE bytes at a
+    time. The length is known up front, so the body goes out with a
+    Content-Length, and memory use does not depend on the attachment
+    sizes. seek(0) starts over for a retry.
+    """
+    def __init__(self, files, chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = \
+            'multipart/form-data; boundary={}'.format(self.boundary)
+        self.chunk_size = chunk_size
+        self._parts = []
+        for field, (filename, content, mime) in files:
+            header = '--{}\r\nContent-Disposition: form-data; ' \
+                'name="{}"'.format(self.boundary, field)
+            if filename is not None:
+                header += '; filename="{}"'.format(
+                    filename.replace('"', '%22'))
+            if mime is not None:
+                header += '\r\nContent-Type: {}'.format(mime)
+            self._parts.append((header + '\r\n\r\n').encode('utf8'))
+            if isinstance(content, str):
+                content = content.encode('utf8')
+            self._parts.append(content)
+            self._parts.append(b'\r\n')
+        self._parts.append('--{}--\r\n'.format(self.boundary).encode('utf8'))
+        self.length = sum(part.stat().st_size
+                          if isinstance(part, pathlib.Path) else len(part)
+                          for part in self._parts)
+        self._index = 0
+        self._offset = 0
+        self._fd = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        """Read up to size bytes of the body (all of it if size < 0)"""
+        if size is None or size < 0:
+            return b''.join(iter(self))
+
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, pathlib.Path):
+                if self._fd is None:
+                    self._fd = part.open('rb')
+                chunk = self._fd.read(min(size, self.chunk_size))
+                if not chunk:
+                    self._fd.close()
+                    self._fd = None
+                    self._next()
+                    continue
+            else:
+                chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._next()
+            chunks.append(chunk)
+            size -= len(chunk)
+
+        return b''.join(chunks)
+
+    def _next(self):
+        self._index += 1
+        self._offset = 0
+
+    def seek(self, offset, whence=0):
+        """Go back to the start (the only position supported)"""
+        if offset != 0 or whence != 0:
+            raise ValueError('MultipartStream can only seek to the start')
+        self.close()
+        self._index = 0
+        self._offset = 0
+
+        return 0
+
+    def close(self):
+        """Close the attachment being read"""
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
@@ -0,0 +1,131 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""On-disk cache of parsed result files"""
+import gzip
+import hashlib
+import os
+import pickle
+import threading
+import uuid
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.results import PARSER_VERSION
+
+
+class ResultsCache:
+    """Cache of parsed TestResults keyed by file content hash.
+
+    Entries are gzipped pickles named after the sha256 of the raw result
+    file and the parser version, so a changed file or a parser change is
+    simply a miss. The least recently used entries are removed once the
+    cache grows past max_size bytes. Only point this at a directory you
+    trust, entries are unpickled.
+    """
+    def __init__(self, cache_dir, max_size=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def stats(self):
+        """Cache statistics for the run output"""
+        return {'dir': self.cache_dir,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    @staticmethod
+    def get_hash(fqpath, chunk_size=1024 * 1024):
+        """Get the sha256 hex digest of a file's content"""
+        sha256 = hashlib.sha256()
+        with open(fqpath, 'rb') as cachefd:
+            for chunk in iter(lambda: cachefd.read(chunk_size), b''):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def get_key(self, fqpath):
+        """Get the cache key of a result file"""
+        return '{}-v{}'.format(ResultsCache.get_hash(fqpath), PARSER_VERSION)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, '{}.pickle.gz'.format(key))
+
+    def get(self, key):
+        """Get cached results or None"""
+        entry_path = self._entry_path(key)
+        try:
+            with gzip.open(entry_path, 'rb') as cachefd:
+                results = pickle.load(cachefd)
+            # mark as recently used
+            os.utime(entry_path)
+        except FileNotFoundError:
+            results = None
+        except (EOFError, OSError, pickle.UnpicklingError) as err:
+            g.log.warning('Dropping unreadable cache entry %s: %s',
+                          entry_path, err)
+            self._remove(entry_path)
+            results = None
+
+        with self._lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        g.log.debug('Cache %s for %s', 'miss' if results is None else 'hit',
+                    key)
+
+        return results
+
+    def put(self, key, results):
+        """Store results and evict old entries if over max_size"""
+        entry_path = self._entry_path(key)
+        tmp_path = '{}.{}.tmp'.format(entry_path, uuid.uuid4().hex)
+        with gzip.open(tmp_path, 'wb', compresslevel=1) as cachefd:
+            pickle.dump(results, cachefd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under max_size"""
+        with self._lock:
+            entries = []
+            with os.scandir(self.cache_dir) as dir_entries:
+                for entry in dir_entries:
+                    if entry.name.endswith('.pickle.gz'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size,
+                                        entry.path))
+
+            total_size = sum(entry[1] for entry in entries)
+            for _, size, entry_path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                self._remove(entry_path)
+                total_size -= size
+                self.evictions += 1
+
+    @staticmethod
+    def _remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
@@ -36,10 +36,28 @@ class Configs:
         self._service_url = NULL
         self._payload_dir = NULL
         self._merge_launches = NULL
+        self._single_launch = NULL
         self._simple_xml = NULL
+        self._stream_xml = NULL
+        self._jobs = NULL
+        self._shards = NULL
+        self._pipeline = NULL
+        self._preflight = NULL
+        self._durations_description = NULL
+        self._compact_passed = NULL
+        self._queue_size = NULL
+        self._output_spill_size = NULL
+        self._spool_dir = NULL
+        self._journal_dir = NULL
+        self._resume = NULL
         self._auto_dashboard = NULL
         self._debug = NULL
         self._log_filepath = NULL
+        self._results_include = NULL
+        self._results_exclude = NULL
+        self._results_max_depth = NULL
+        self._cache_dir = NULL
+        self._cache_max_size = NULL
 
         self._config = {}
         g.log.debug('Configs.init(): reading %s', self._fqpath)
@@ -101,6 +119,57 @@ class Configs:
     def payload_dir(self, payload_dir):
         self._payload_dir = payload_dir
 
+    @property
+    def results_include(self):
+        """Glob patterns of result file names to import"""
+        if self._results_include is NULL:
+            self._results_include = Configs.get_list(
+                self.get_config_item('results_include',
+                                     config=self.service_config))
+
+        return self._results_include
+
+    @property
+    def results_exclude(self):
+        """Glob patterns of files and directories in results to skip"""
+        if self._results_exclude is NULL:
+            self._results_exclude = Configs.get_list(
+                self.get_config_item('results_exclude',
+                                     config=self.service_config))
+
+        return self._results_exclude
+
+    @property
+    def results_max_depth(self):
+        """Levels of subdirectories of results to search for files"""
+        if self._results_max_depth is NULL:
+            max_depth = self.get_config_item('results_max_depth',
+                                             config=self.service_config)
+            self._results_max_depth = \
+                int(max_depth) if max_depth is not None else None
+
+        return self._results_max_depth
+
+    @property
+    def cache_dir(self):
+        """Directory caching parsed result files (None to disable)"""
+        if self._cache_dir is NULL:
+            self._cache_dir = self.get_config_item('cache_dir',
+                                                   config=self.service_config)
+
+        return self._cache_dir
+
+    @property
+    def cache_max_size(self):
+        """Size in bytes the parsed results cache is trimmed to"""
+        if self._cache_max_size is NULL:
+            self._cache_max_size = int(
+                self.get_config_item('cache_max_size',
+                                     config=self.service_config,
+                                     default=1024 ** 3))
+
+        return self._cache_max_size
+
     @property
     def service_url(self):
         """use_service - send to service or use local client"""
@@ -120,6 +189,123 @@ class Configs:
 
         return self._simple_xml
 
+    @property
+    def stream_xml(self):
+        """Parse and import xml incrementally instead of loading it whole"""
+        if self._stream_xml is NULL:
+            self._stream_xml = Configs.get_bool(
+                self.get_config_item('stream_xml', config=self.rp_config))
+
+        return self._stream_xml
+
+    @property
+    def jobs(self):
+        """Number of result files to import concurrently"""
+        if self._jobs is NULL:
+            self._jobs = int(self.get_config_item('jobs',
+                                                  config=self.rp_config,
+                                                  default=1) or 1)
+
+        return self._jobs
+
+    @property
+    def shards(self):
+        """Number of workers reporting the testcases of one testsuite"""
+        if self._shards is NULL:
+            self._shards = int(self.get_config_item('shards',
+                                                    config=self.rp_config,
+                                                    default=1) or 1)
+
+        return self._shards
+
+    @property
+    def preflight(self):
+        """Scan all result files before starting any launch (default on)"""
+        if self._preflight is NULL:
+            self._preflight = Configs.get_bool(
+                self.get_config_item('preflight', config=self.rp_config,
+                                     default=True))
+
+        return self._preflight
+
+    @property
+    def durations_description(self):
+        """Add the test duration summary to the launch description"""
+        if self._durations_description is NULL:
+            self._durations_description = Configs.get_bool(
+                self.get_config_item('durations_description',
+                                     config=self.rp_config))
+
+        return self._durations_description
+
+    @property
+    def compact_passed(self):
+        """Report the passed testcases of a testsuite as one summary item"""
+        if self._compact_passed is NULL:
+            self._compact_passed = Configs.get_bool(
+                self.get_config_item('compact_passed',
+                                     config=self.rp_config))
+
+        return self._compact_passed
+
+    @property
+    def pipeline(self):
+        """Run parse, transform and upload as stages with bounded queues"""
+        if self._pipeline is NULL:
+            self._pipeline = Configs.get_bool(
+                self.get_config_item('pipeline', config=self.rp_config))
+
+        return self._pipeline
+
+    @property
+    def queue_size(self):
+        """Maximum number of items waiting between pipeline stages"""
+        if self._queue_size is NULL:
+            self._queue_size = int(
+                self.get_config_item('queue_size', config=self.rp_config,
+                                     default=1000) or 1000)
+
+        return self._queue_size
+
+    @property
+    def output_spill_size(self):
+        """Characters of a system-out/system-err kept in memory before it is
+        spilled to a compressed attachment (0 keeps everything)"""
+        if self._output_spill_size is NULL:
+            self._output_spill_size = int(
+                self.get_config_item('output_spill_size',
+                                     config=self.rp_config,
+                                     default=1024 ** 2) or 0) or None
+
+        return self._output_spill_size
+
+    @property
+    def spool_dir(self):
+        """Spool operations here instead of sending them to ReportPortal"""
+        if self._spool_dir is NULL:
+            self._spool_dir = self.get_config_item('spool_dir',
+                                                   config=self.rp_config)
+
+        return self._spool_dir
+
+    @property
+    def journal_dir(self):
+        """Directory of the checkpoint journals of imports (None for none)"""
+        if self._journal_dir is NULL:
+            self._journal_dir = self.get_config_item('journal_dir',
+                                                     config=self.rp_config)
+
+        return self._journal_dir
+
+    @property
+    def resume(self):
+        """Continue interrupted imports from their journals"""
+        if self._resume is NULL:
+            self._resume = Configs.get_bool(
+                self.get_config_item('resume', config=self.rp_config))
+
+        return self._resume
+
     @property
     def merge_launches(self):
         """Config merge launches after import"""
@@ -129,6 +315,15 @@ class Configs:
 
         return self._merge_launches
 
+    @property
+    def single_launch(self):
+        """Import all result files into one launch, a suite per file"""
+        if self._single_launch is NULL:
+            self._single_launch = Configs.get_bool(
+                self.get_config_item('single_launch', config=self.rp_config))
+
+        return self._single_launch
+
     @property
     def auto_dashboard(self):
         """Automatically create dashboards"""
@@ -156,6 +351,22 @@ class Configs:
 
         return self._log_filepath
 
+    @staticmethod
+    def get_bool(value):
+        """Normalize a boolean config item (env vars are strings)"""
+        if isinstance(value, str):
+            return value.lower() not in ('', '0', 'false', 'no', 'off')
+
+        return bool(value)
+
+    @staticmethod
+    def get_list(value):
+        """Normalize a list config item (env vars are comma separated)"""
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(',') if item.strip()]
+
+        return value
+
     # PRIVATE METHODS
     def _read_fqpath(self, fqpath=None):
         """Read a json formatted file into a dictionary"""
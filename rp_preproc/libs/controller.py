@@ -0,0 +1,258 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Adaptive concurrency and retries for ReportPortal API calls"""
+import asyncio
+import random
+import threading
+import time
+
+from glusto.core import Glusto as g
+
+
+# worth another try, the server is busy or briefly unavailable
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# the server telling us to slow down
+THROTTLE_STATUSES = (429, 503)
+# sending these twice does no harm
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def retry_statuses(method):
+    """Statuses a call can be retried on
+
+    Any retryable status for idempotent methods. A POST (starting a launch
+    or item) may have been acted on before a 5xx or a timeout, so it is
+    only retried when the server says it did not take it (429/503).
+    """
+    if method is None or method.upper() in IDEMPOTENT_METHODS:
+        return RETRY_STATUSES
+
+    return THROTTLE_STATUSES
+
+
+class RequestController:
+    """Retry and in-flight limit shared by every call to one RP server.
+
+    Failed calls with a retryable status (or no connection) are retried
+    with jittered exponential backoff, honouring Retry-After. Calls that
+    are not idempotent are only retried when the server can not have
+    acted on them (see retry_statuses()). The number
+    of calls in flight is adjusted AIMD style: it grows by about one per
+    round trip while latency stays under latency_target and is halved
+    on a throttle response, an error or a latency spike. A limiter (e.g.
+    SharedRateLimiter) adds a budget shared with other processes.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=256,
+                 retries=5, backoff=0.5, max_backoff=30.0,
+                 latency_target=2.0):
+        """Create a controller
+
+        Args:
+            initial_limit (int): calls in flight to start with
+            retries (int): retries of a failing call before giving up
+            backoff (float): first backoff in seconds, doubled per retry
+            max_backoff (float): longest backoff in seconds
+            latency_target (float): seconds a healthy call takes at most
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.limiter = None
+        self.counts = {'requests': 0, 'retries': 0, 'throttled': 0,
+                       'errors': 0, 'decreases': 0, 'failed': 0}
+        self.lowest_limit = self.limit
+        self.highest_limit = self.limit
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # (loop, future) of the asyncio callers waiting for a slot
+        self._waiters = []
+
+    @property
+    def stats(self):
+        """Limits and counters to report at the end of an import"""
+        with self._condition:
+            stats = {'limit': int(self.limit),
+                     'lowest_limit': int(self.lowest_limit),
+                     'highest_limit': int(self.highest_limit),
+                     'in_flight': self.in_flight}
+            stats.update(self.counts)
+        if self.limiter is not None:
+            stats['rate_limit'] = self.limiter.stats
+
+        return stats
+
+    def try_acquire(self):
+        """Take an in-flight slot if one is free (does not block)"""
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+
+        return False
+
+    def acquire(self):
+        """Wait for an in-flight slot"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """Wait for an in-flight slot without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            await waiter
+
+    def _notify(self):
+        # with the condition held, wake the sync and asyncio waiters
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def release(self, latency, status=None):
+        """Give the slot back and adjust the limit
+
+        Args:
+            latency (float): seconds the call took
+            status (int): response status, None when there was no response
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.counts['requests'] += 1
+            if status in THROTTLE_STATUSES:
+                self.counts['throttled'] += 1
+                self._decrease('throttled ({})'.format(status))
+            elif status is None or status >= 500:
+                self.counts['errors'] += 1
+                self._decrease('error ({})'.format(status))
+            elif latency > self.latency_target:
+                self._decrease('latency {:.1f}s'.format(latency))
+            elif self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.highest_limit = max(self.highest_limit, self.limit)
+            self._notify()
+
+    def abandon(self):
+        """Give the slot back for a call that was never made"""
+        with self._condition:
+            self.in_flight -= 1
+            self._notify()
+
+    def _decrease(self, reason):
+        # the calls in flight when trouble starts all report it, so cut
+        # at most once per latency target instead of once per call
+        now = time.time()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        self.counts['decreases'] += 1
+        g.log.info('RequestController: %s, in-flight limit now %d',
+                   reason, self.limit)
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Seconds to wait before a retry, None when out of retries
+
+        Args:
+            attempt (int): retries done so far
+            retry_after (str): Retry-After header of the response
+        """
+        if attempt >= self.retries:
+            with self._condition:
+                self.counts['failed'] += 1
+            return None
+
+        with self._condition:
+            self.counts['retries'] += 1
+        try:
+            return min(self.max_backoff, float(retry_after))
+        except (TypeError, ValueError):
+            # full jitter keeps a crowd of retries from arriving together
+            return random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, send, method=None, unsent=None):
+        """Call send() within the limit, retrying retryable failures
+
+        Args:
+            send (func): makes the call and returns a requests.Response
+            method (str): HTTP method of the call (None retries like an
+                idempotent one)
+            unsent (func): tells whether an exception raised by send()
+                came before the request went out, for the calls that are
+                not idempotent
+
+        Returns:
+            the last response (raises the last connection error)
+        """
+        statuses = retry_statuses(method)
+        idempotent = statuses is RETRY_STATUSES
+        attempt = 0
+        while True:
+            self.acquire()
+            lease_id = None
+            if self.limiter is not None:
+                try:
+                    lease_id = self.limiter.acquire()
+                except BaseException:
+                    self.abandon()
+                    raise
+            start = time.time()
+            try:
+                response = send()
+            except OSError as err:
+                # requests' ConnectionError and Timeout are OSErrors
+                self.release(time.time() - start)
+                if not idempotent and (unsent is None or not unsent(err)):
+                    raise
+                delay = self.retry_delay(attempt)
+                if delay is None:
+                    raise
+                g.log.warning('Retrying in %.1fs after %s', delay, err)
+            else:
+                self.release(time.time() - start, response.status_code)
+                if response.status_code not in statuses:
+                    return response
+                delay = self.retry_delay(
+                    attempt, response.headers.get('Retry-After'))
+                if delay is None:
+                    return response
+                g.log.warning('Retrying %s in %.1fs after %s',
+                              response.url, delay, response.status_code)
+            finally:
+                if lease_id is not None:
+                    self.limiter.release(lease_id)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,218 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Checkpoint journal for resuming interrupted imports"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from glusto.core import Glusto as g
+
+
+JOURNAL_SUFFIX = '.journal'
+DEFAULT_FSYNC_EVERY = 100
+DEFAULT_FSYNC_INTERVAL = 1.0
+
+
+def pending(service):
+    """Future of the last request an async service queued (None for the
+    sync service, whose calls are done when they return)"""
+    return getattr(service, 'last_request', None)
+
+
+class ImportJournal:
+    """Append-only NDJSON record of what one result file's import created.
+
+    Testsuites and testcases are identified by their position in the
+    file's event stream and the journal is named by a hash of the file's
+    contents, so a rerun of the same file lines up with it. Every record
+    is written straight through to the OS, which is enough to survive the
+    process dying; fsync (for surviving the host) is batched every
+    fsync_every records or fsync_interval seconds. Records waiting for a
+    request are written before the launch is recorded finished and
+    before the journal closes; a record arriving after the close (a log
+    batch confirmed late) is appended and synced on its own.
+
+    Records:
+        launch        the launch was started, with its id
+        start         the testsuite/testcase at pos was started, with its id
+        finish        the testsuite/testcase at pos was finished
+        logged        the logs of the testcase at pos are in ReportPortal
+        launch_finish the launch was finished, the import is complete
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, journal_dir, key, resume=False,
+                 fsync_every=DEFAULT_FSYNC_EVERY,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        """Open the journal of a result file
+
+        Args:
+            journal_dir (str): directory holding the journals
+            key (str): content hash of the result file (see key())
+            resume (bool): continue the journal instead of starting over
+        """
+        os.makedirs(journal_dir, exist_ok=True)
+        self.filename = os.path.join(journal_dir, key + JOURNAL_SUFFIX)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.launch_id = None
+        self.launch_finished = False
+        # position -> RP id
+        self.started = {}
+        self.finished = set()
+        self.logged = set()
+        self.records = 0
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self._lock = threading.Lock()
+        # records waiting for their request to be done
+        self._pending = 0
+        self._drained = threading.Condition()
+
+        if resume and os.path.exists(self.filename):
+            self._load()
+            g.log.info('Resuming %s: launch %s, %s item(s) started, '
+                       '%s finished, %s logged', self.filename,
+                       self.launch_id, len(self.started),
+                       len(self.finished), len(self.logged))
+        self._fd = open(self.filename, 'a' if resume else 'w')
+
+    @staticmethod
+    def key(fqpath):
+        """Hash the contents of a result file"""
+        digest = hashlib.sha256()
+        with open(fqpath, 'rb') as resultfd:
+            for chunk in iter(lambda: resultfd.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    @property
+    def resuming(self):
+        """Was the launch started by an earlier run?"""
+        return self.launch_id is not None
+
+    def _load(self):
+        """Read the records of an earlier run"""
+        good = 0
+        with open(self.filename, 'rb') as journalfd:
+            for line in journalfd:
+                try:
+                    record = json.loads(line.decode('utf8'))
+                except ValueError:
+                    # the run died in the middle of this record
+                    break
+                good += len(line)
+                self._apply(record)
+        # drop a torn record so new ones start on a line of their own
+        if good != os.path.getsize(self.filename):
+            os.truncate(self.filename, good)
+
+    def _apply(self, record):
+        operation = record['op']
+        if operation == 'launch':
+            self.launch_id = record['id']
+        elif operation == 'start':
+            self.started[record['pos']] = record['id']
+        elif operation == 'finish':
+            self.finished.add(record['pos'])
+        elif operation == 'logged':
+            self.logged.add(record['pos'])
+        elif operation == 'launch_finish':
+            self.launch_finished = True
+
+    def record(self, record, after=None):
+        """Append a record, once the request after is done if given
+
+        Args:
+            record (dict): the record
+            after (obj): future of the request the record depends on
+        """
+        if after is not None:
+            with self._drained:
+                self._pending += 1
+
+            def done(future):
+                try:
+                    # a failed request is left for the resumed run to redo
+                    if future.exception() is None:
+                        self.record(record)
+                finally:
+                    with self._drained:
+                        self._pending -= 1
+                        self._drained.notify_all()
+            after.add_done_callback(done)
+            return
+
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._apply(record)
+            if self._fd.closed:
+                with open(self.filename, 'a') as journalfd:
+                    journalfd.write(line + '\n')
+                    journalfd.flush()
+                    os.fsync(journalfd.fileno())
+                self.records += 1
+                return
+            self._fd.write(line + '\n')
+            self._fd.flush()
+            self.records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or \
+                    time.time() - self._synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._fd.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def launch_started(self, launch_id, after=None):
+        """Record the started launch"""
+        self.record({'op': 'launch', 'id': launch_id}, after=after)
+
+    def item_started(self, position, item_id, after=None):
+        """Record a started testsuite or testcase"""
+        self.record({'op': 'start', 'pos': position, 'id': item_id},
+                    after=after)
+
+    def item_finished(self, position, after=None):
+        """Record a finished testsuite or testcase"""
+        self.record({'op': 'finish', 'pos': position}, after=after)
+
+    def item_logged(self, position, after=None):
+        """Record that all logs of a testcase were sent (and the testcase
+        finished)"""
+        self.record({'op': 'logged', 'pos': position}, after=after)
+
+    def drain(self):
+        """Wait until the records waiting for requests are written"""
+        with self._drained:
+            self._drained.wait_for(lambda: self._pending == 0)
+
+    def launch_done(self):
+        """Record the finished launch"""
+        self.drain()
+        self.record({'op': 'launch_finish'})
+
+    def close(self):
+        """Sync and close the journal"""
+        self.drain()
+        with self._lock:
+            if not self._fd.closed:
+                self._sync()
+                self._fd.close()
@@ -0,0 +1,178 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Staged import pipeline connected by bounded queues"""
+import queue
+import threading
+import time
+
+from glusto.core import Glusto as g
+
+
+# end of stream marker passed between stages
+DONE = object()
+
+
+class PipelineQueue(queue.Queue):
+    """Bounded queue keeping depth and wait statistics for tuning"""
+    def __init__(self, name, maxsize):
+        super().__init__(maxsize=maxsize)
+        self.name = name
+        self.count = 0
+        self.max_depth = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.time()
+        try:
+            super().put(item, block, timeout)
+        finally:
+            # time spent here is backpressure from the consuming stage
+            self.put_wait += time.time() - start
+        self.count += 1
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def get(self, block=True, timeout=None):
+        start = time.time()
+        try:
+            return super().get(block, timeout)
+        finally:
+            # time spent here means the producing stage is the bottleneck
+            self.get_wait += time.time() - start
+
+    @property
+    def stats(self):
+        """Queue statistics"""
+        return {'size': self.maxsize,
+                'items': self.count,
+                'depth': self.qsize(),
+                'max_depth': self.max_depth,
+                'put_wait': round(self.put_wait, 3),
+                'get_wait': round(self.get_wait, 3)}
+
+
+class Pipeline:
+    """Run the import as parse -> transform -> upload stages.
+
+    The parser and the transform stage run in their own threads and the
+    caller iterates over the transformed events as the upload stage.
+    Every stage is connected by a bounded queue, so a slow uploader holds
+    the parser back instead of letting parsed testcases pile up in memory.
+    """
+    def __init__(self, queue_size=1000):
+        self.queues = [PipelineQueue('parsed', queue_size),
+                       PipelineQueue('transformed', queue_size)]
+        self._errors = []
+        self._stop = threading.Event()
+
+    @property
+    def stats(self):
+        """Statistics of all stage queues (same-named queues summed up)"""
+        stats = {}
+        for pqueue in self.queues:
+            queue_stats = pqueue.stats
+            if pqueue.name in stats:
+                total = stats[pqueue.name]
+                for key in ('items', 'depth', 'put_wait', 'get_wait'):
+                    total[key] = round(total[key] + queue_stats[key], 3)
+                total['max_depth'] = max(total['max_depth'],
+                                         queue_stats['max_depth'])
+            else:
+                stats[pqueue.name] = queue_stats
+
+        return stats
+
+    def add_queue(self, pqueue):
+        """Include another queue (e.g. upload shards) in the stats"""
+        self.queues.append(pqueue)
+
+    def run(self, events, transform):
+        """Run the stages and yield transformed events
+
+        Args:
+            events (iter): (event, record) tuples from a parser
+            transform (func): called with (event, record) and returning
+                the (event, data) tuple handed to the upload stage
+        """
+        parsed, transformed = self.queues[:2]
+        self._start('parse', self._parse, parsed, events)
+        self._start('transform', self._transform, transformed, parsed,
+                    transform)
+        try:
+            while True:
+                item = transformed.get()
+                if item is DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            g.log.debug('Pipeline queues: %s', self.stats)
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _start(self, name, target, out_queue, *args):
+        thread = threading.Thread(target=self._run_stage, name=name,
+                                  args=(target, out_queue) + args)
+        thread.daemon = True
+        thread.start()
+
+    def _run_stage(self, target, out_queue, *args):
+        try:
+            target(out_queue, *args)
+        except Exception as err:  # pylint: disable=broad-except
+            g.log.error('Pipeline stage failed: %s', err)
+            self._errors.append(err)
+        self._put(out_queue, DONE)
+
+    def _put(self, out_queue, item):
+        """Put with backpressure, giving up once the consumer has stopped"""
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _get(self, in_queue):
+        """Get, giving up (DONE) once the consumer has stopped"""
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+        return DONE
+
+    def _parse(self, out_queue, events):
+        try:
+            for item in events:
+                if not self._put(out_queue, item):
+                    return
+        finally:
+            # closes the result file of a parser stopped early
+            if hasattr(events, 'close'):
+                events.close()
+
+    def _transform(self, out_queue, in_queue, transform):
+        while True:
+            item = self._get(in_queue)
+            if item is DONE or self._errors:
+                return
+            if not self._put(out_queue, transform(*item)):
+                return
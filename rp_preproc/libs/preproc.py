@@ -14,19 +14,27 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 #
 """PreProc module for importing data into ReportPortal"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import gzip
+import hashlib
 import json
 import os
+import queue
 import shutil
 import tarfile
+import tempfile
 import uuid
-import xmltodict
 
 from glusto.core import Glusto as g
 
+from rp_preproc.libs.attachments import AttachmentIndex
+from rp_preproc.libs.cache import ResultsCache
 from rp_preproc.libs.configs import Configs
-from rp_preproc.libs.reportportal import (ReportPortal, Filter, Dashboard,
-                                          WidgetLaunchesTable,
+from rp_preproc.libs.journal import ImportJournal, pending
+from rp_preproc.libs.replay import Replay
+from rp_preproc.libs.reportportal import (ReportPortal, Launch, Filter,
+                                          Dashboard, WidgetLaunchesTable,
                                           WidgetOverallStats)
 from rp_preproc.libs.xunit_xml import XunitXML
 
@@ -49,6 +57,44 @@ class PreProc:
         self._config_file = self.args.get('config_file', None)
         g.log.debug('ARGS: %s', self._args)
         self._configs = None
+        self._cache = None
+        self._attachment_index = None
+        self._spill_dir = None
+        # fqpath -> content hash, for the journals
+        self._journal_keys = {}
+        self._journal_dir = None
+        # journals of the files in a single launch, completed with it
+        self._journals = []
+        # summary attachment directories of the files in a single launch,
+        # removed once it is finished
+        self._tmp_dirs = []
+
+    @property
+    def cache(self):
+        """Cache of parsed result files (None if not configured)"""
+        if self._cache is None and self.configs.cache_dir:
+            self._cache = ResultsCache(self.configs.cache_dir,
+                                       max_size=self.configs.cache_max_size)
+
+        return self._cache
+
+    @property
+    def attachment_index(self):
+        """AttachmentIndex of the payload, scanned on first use"""
+        if self._attachment_index is None:
+            self._attachment_index = AttachmentIndex(
+                os.path.join(self.configs.payload_dir, 'attachments'))
+
+        return self._attachment_index
+
+    @property
+    def spill_dir(self):
+        """Directory large system-out/system-err are spilled to until the
+        import is done (None when spilling is off)"""
+        if self._spill_dir is None and self.configs.output_spill_size:
+            self._spill_dir = tempfile.mkdtemp(prefix='rp_preproc_output_')
+
+        return self._spill_dir
 
     @staticmethod
     def get_uuid():
@@ -103,38 +149,142 @@ class PreProc:
     def process(self):
         """Process the files in the payload for importing into ReportPortal"""
         g.log.debug('PREPROCESSING STARTED')
-        rportal = ReportPortal(self.configs.rp_config)
+        # part launches are only needed for merging
+        rportal = ReportPortal(
+            self.configs.rp_config, spool_dir=self.configs.spool_dir,
+            merge_launches=False if self.single_launch else None)
         # get list of xml result files
         results_file_dir = os.path.join(self.configs.payload_dir, 'results')
-        result_file_list = XunitXML.get_file_list(results_file_dir)
+        result_file_list = XunitXML.get_file_list(
+            results_file_dir, include=self.configs.results_include,
+            exclude=self.configs.results_exclude,
+            max_depth=self.configs.results_max_depth)
         return_obj = {}
 
-        # Loop through result files in drop directory
-        responses = []
-        for fqpath in result_file_list:
-            with open(fqpath) as xmlfd:
-                g.log.debug('Processing fqpath %s', fqpath)
-                filename = os.path.basename(fqpath)
-                filename_base, _ = os.path.splitext(filename)
-                g.log.debug('%s %s', filename, filename_base)
-                if self.configs.simple_xml:
-                    # this is for xml file import without processing
-                    g.log.debug('Sending file...')
-                    response = rportal.api_post_zipfile(fqpath)
-                else:
-                    g.log.debug('Parsing XML...')
-                    xml_data = xmltodict.parse(xmlfd.read())
-                    xunit_xml = XunitXML(rportal, name=filename_base,
-                                         configs=self._configs,
-                                         xml_data=xml_data)
-                    response = xunit_xml.process()
-                    responses.append(response)
+        # Check every file before any launch is started
+        if self.configs.preflight and not self.simple_xml:
+            log_buffer = rportal.log_buffer
+            preflight = self.preflight(
+                result_file_list,
+                log_batch_size=log_buffer.batch_size if log_buffer else 1)
+            return_obj['preflight'] = preflight
+            if not preflight['valid']:
+                g.log.error('PREFLIGHT FAILED, nothing was imported: %s',
+                            [report for report in preflight['files']
+                             if not report['valid']])
+                return_obj['launches'] = []
+                if self.cache is not None:
+                    return_obj['cache'] = self.cache.stats
+                return return_obj
+
+        # Import the result files in the drop directory, several at a time
+        # when jobs > 1. Each worker gets its own ReportPortal clone (its own
+        # service) and all of them add launch ids to the shared launch list.
+        # With single_launch the files go into one launch started here, so
+        # the clones are forked at it.
+        launch, launch_journal = None, None
+        try:
+            import_file = self.import_file
+            if self.single_launch:
+                launch, launch_journal, launch_id = \
+                    self.start_single_launch(rportal, result_file_list)
+                import_file = functools.partial(self.import_file,
+                                                launch_id=launch_id)
+            # created before the jobs start, they all spill into it
+            g.log.debug('Output spill directory: %s', self.spill_dir)
+            jobs = self.configs.jobs
+            g.log.debug('Importing %s file(s) with %s job(s)',
+                        len(result_file_list), jobs)
+            if jobs > 1:
+                # one clone per job, set up front so the clones share what
+                # rportal set up, each importing one file after another
+                clones = queue.Queue()
+                for _ in range(min(jobs, len(result_file_list))):
+                    clones.put(rportal.fork() if self.single_launch
+                               else rportal.clone())
+
+                def import_next(fqpath):
+                    clone = clones.get()
+                    try:
+                        return import_file(clone, fqpath)
+                    finally:
+                        clones.put(clone)
+
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    responses = list(executor.map(import_next,
+                                                  result_file_list))
+            else:
+                responses = [import_file(rportal, fqpath)
+                             for fqpath in result_file_list]
+            if launch is not None:
+                launch.finish()
+                for journal in self._journals + [launch_journal]:
+                    if journal is not None:
+                        journal.launch_done()
+            rportal.close()
+        finally:
+            # a failed import is resumed from what the journals hold
+            for journal in self._journals + [launch_journal]:
+                if journal is not None:
+                    journal.close()
+            self._journals = []
+            # the launches are finished (or failed), nothing is sent from
+            # the spilled outputs any more
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+            for tmp_dir in self._tmp_dirs:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._tmp_dirs = []
+        return_obj['controller'] = rportal.session.controller.stats
+        g.log.info('Request controller: %s', return_obj['controller'])
+        if rportal.attachment_dedup is not None:
+            return_obj['attachment_dedup'] = rportal.attachment_dedup.stats
+            g.log.info('Attachment dedup: %s', return_obj['attachment_dedup'])
+        if rportal.attachment_policy is not None:
+            return_obj['attachment_policy'] = rportal.attachment_policy.stats
+            g.log.info('Attachment policy: %s',
+                       return_obj['attachment_policy'])
+        if self.cache is not None:
+            return_obj['cache'] = self.cache.stats
+            g.log.info('Parse cache: %s', return_obj['cache'])
 
         #return_obj["responses"] = responses
 
-        # Merge launches
+        # Duration summaries and journal progress per result file
+        durations = {}
+        journals = {}
+        for fqpath, response in zip(result_file_list, responses):
+            if isinstance(response, tuple) and 'durations' in response[0]:
+                durations[XunitXML.get_name(fqpath)] = \
+                    response[0]['durations']
+            if isinstance(response, tuple) and 'journal' in response[0]:
+                journals[XunitXML.get_name(fqpath)] = response[0]['journal']
+        if durations:
+            return_obj['durations'] = durations
+        if journals:
+            return_obj['journal'] = journals
+
+        # Attachments no testcase picked up (e.g. misspelled directories)
+        if not self.simple_xml:
+            orphans = self.attachment_index.orphans(
+                [XunitXML.get_name(fqpath) for fqpath in result_file_list])
+            if orphans:
+                g.log.warning('%s attachment director(ies) not used by any '
+                              'failed testcase: %s', len(orphans), orphans)
+                return_obj['orphan_attachments'] = orphans
+
         launch_list = rportal.launches.list
-        if len(result_file_list) > 1:
+        if self.configs.spool_dir:
+            # nothing is in ReportPortal yet, replay merges
+            g.log.info('Spooled %s launch(es) to %s', len(launch_list),
+                       self.configs.spool_dir)
+            return_obj['spool'] = self.configs.spool_dir
+            return_obj['launches'] = launch_list
+            return return_obj
+
+        # Merge launches
+        if len(result_file_list) > 1 and not self.single_launch:
             #print('DO THE MERGE ON: {}'.format(self.configs.merge_launches))
             #print(type(self.configs.merge_launches))
             if self.configs.merge_launches:
@@ -162,6 +312,163 @@ class PreProc:
         g.log.debug('RETURN OBJECT: %s', return_obj)
         return return_obj
 
+    def replay(self, spool_dir, workers=8):
+        """Send the launches spooled in spool_dir to ReportPortal"""
+        g.log.debug('REPLAY STARTED')
+        rportal = ReportPortal(self.configs.rp_config, api_mode='sync')
+        replay = Replay(rportal, workers=workers)
+        return_obj = {'launches': replay.replay_dir(spool_dir),
+                      'replay': replay.stats}
+
+        if len(return_obj['launches']) > 1 and self.configs.merge_launches:
+            return_obj['merged_launch'] = \
+                rportal.launches.merge(merge_type='DEEP')
+        return_obj['controller'] = rportal.session.controller.stats
+
+        g.log.debug('RETURN OBJECT: %s', return_obj)
+        return return_obj
+
+    @property
+    def single_launch(self):
+        """Import all files into one launch? (not with simple_xml)"""
+        if self.configs.single_launch and self.simple_xml:
+            g.log.warning('single_launch is ignored with simple_xml')
+            return False
+
+        return self.configs.single_launch
+
+    def start_single_launch(self, rportal, result_file_list):
+        """Start (or resume) the launch of a single_launch import
+
+        Returns:
+            (Launch to finish or None if already finished, its
+            ImportJournal or None, launch id)
+        """
+        journal = None
+        if self.configs.journal_dir and rportal.api_mode != 'spool':
+            # the launch is journaled under the hash of all the files and
+            # the files in a directory of that name
+            for fqpath in result_file_list:
+                self._journal_keys[fqpath] = ImportJournal.key(fqpath)
+            key = hashlib.sha256(''.join(sorted(
+                self._journal_keys.values())).encode('utf8')).hexdigest()
+            journal = ImportJournal(self.configs.journal_dir, key,
+                                    resume=self.configs.resume)
+            self._journal_dir = os.path.join(self.configs.journal_dir, key)
+
+        launch = Launch(rportal)
+        if journal is not None and journal.launch_finished:
+            g.log.info('Already imported into launch %s', journal.launch_id)
+            rportal.launches.add(journal.launch_id)
+            return None, journal, journal.launch_id
+        if journal is not None and journal.resuming:
+            return launch, journal, launch.resume(journal.launch_id)
+
+        launch_id = launch.start()
+        if journal is not None:
+            journal.launch_started(launch_id,
+                                   after=pending(rportal.service))
+
+        return launch, journal, launch_id
+
+    @property
+    def simple_xml(self):
+        """Upload the files through the RP import API? (not when spooling)"""
+        if self.configs.simple_xml and self.configs.spool_dir:
+            g.log.warning('simple_xml is ignored when spooling')
+            return False
+
+        return self.configs.simple_xml
+
+    def preflight(self, result_file_list, log_batch_size=1):
+        """Scan all result files before importing anything
+
+        Args:
+            result_file_list (list): paths of the result files
+            log_batch_size (int): log entries the import sends per call
+
+        Returns:
+            dict with overall validity, totals and the per-file reports
+        """
+        reports = [XunitXML.preflight(fqpath,
+                                      attachment_index=self.attachment_index,
+                                      log_batch_size=log_batch_size)
+                   for fqpath in result_file_list]
+        preflight = {'valid': all(report['valid'] for report in reports),
+                     'files': reports}
+        for key in ('testsuites', 'testcases', 'failures', 'skipped',
+                    'attachments', 'api_calls'):
+            preflight[key] = sum(report.get(key, 0) for report in reports)
+        g.log.info('Preflight: %s file(s), %s testcase(s), %s failure(s), '
+                   '~%s API call(s)', len(reports), preflight['testcases'],
+                   preflight['failures'], preflight['api_calls'])
+
+        return preflight
+
+    def import_file(self, rportal, fqpath, launch_id=None):
+        """Import a single result file into its own launch (or as a suite
+        of the started launch_id)"""
+        g.log.debug('Processing fqpath %s', fqpath)
+        filename = os.path.basename(fqpath)
+        filename_base = XunitXML.get_name(fqpath)
+        g.log.debug('%s %s', filename, filename_base)
+        if self.simple_xml:
+            # this is for xml file import without processing
+            g.log.debug('Sending file...')
+            if XunitXML.is_compressed(fqpath):
+                with XunitXML.open_file(fqpath) as xmlfd:
+                    return rportal.api_post_zipfile(
+                        fqpath, xmlfd=xmlfd,
+                        arcname='{}.xml'.format(filename_base))
+
+            return rportal.api_post_zipfile(fqpath)
+
+        journal = self.open_journal(rportal, fqpath)
+        if launch_id is not None and journal is not None:
+            # completed and closed with the launch
+            self._journals.append(journal)
+        xunit_xml = None
+        try:
+            if self.configs.stream_xml:
+                # parse and import one testcase at a time
+                g.log.debug('Streaming XML...')
+                xunit_xml = XunitXML(rportal, name=filename_base,
+                                     configs=self._configs, fqpath=fqpath,
+                                     journal=journal, launch_id=launch_id,
+                                     attachment_index=self.attachment_index,
+                                     spill_dir=self.spill_dir)
+            else:
+                g.log.debug('Parsing XML...')
+                results = XunitXML.parse(
+                    fqpath, cache=self.cache, spill_dir=self.spill_dir,
+                    spill_size=self.configs.output_spill_size)
+                xunit_xml = XunitXML(rportal, name=filename_base,
+                                     configs=self._configs, results=results,
+                                     journal=journal, launch_id=launch_id,
+                                     attachment_index=self.attachment_index)
+
+            return xunit_xml.process()
+        finally:
+            if launch_id is None:
+                if journal is not None:
+                    journal.close()
+            elif xunit_xml is not None and xunit_xml.tmp_dir is not None:
+                # its summary attachments go out with the launch finish
+                self._tmp_dirs.append(xunit_xml.tmp_dir)
+
+    def open_journal(self, rportal, fqpath):
+        """Open the checkpoint journal of a result file (None if off)"""
+        if not self.configs.journal_dir:
+            return None
+        if rportal.api_mode == 'spool':
+            # a spool is not in ReportPortal yet, there is nothing to resume
+            return None
+
+        key = self._journal_keys.get(fqpath) or ImportJournal.key(fqpath)
+
+        return ImportJournal(self._journal_dir or self.configs.journal_dir,
+                             key, resume=self.configs.resume)
+
     def auto_create_dashboard(self, rportal):
         """Auto-create a default dashboard with basic widgets and a filter"""
         dashboard_obj = {}
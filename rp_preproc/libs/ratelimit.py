@@ -0,0 +1,162 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Rate limit shared by all processes importing into one ReportPortal"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from glusto.core import Glusto as g
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_key ON leases (key);
+'''
+
+
+class SharedRateLimiter:
+    """Token bucket and concurrency cap kept in a local SQLite file.
+
+    Every process (e.g. each gunicorn worker) opens the same file, so the
+    requests per second and the requests in flight are counted across all
+    of them for one ReportPortal endpoint and project. SQLite's write
+    lock serializes the bookkeeping. A request in flight holds a lease
+    that expires after lease_ttl seconds, so a killed worker can not hold
+    its slots forever.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, path, key, rate=None, max_concurrent=None, burst=None,
+                 lease_ttl=600):
+        """Create a limiter
+
+        Args:
+            path (str): SQLite file shared by the processes
+            key (str): what the budget is for (endpoint and project)
+            rate (float): requests per second (None for no limit)
+            max_concurrent (int): requests in flight (None for no limit)
+            burst (float): requests that may go at once after a quiet
+                period (default: one second's worth)
+            lease_ttl (float): seconds until a lease counts as abandoned
+        """
+        self.path = path
+        self.key = key
+        self.rate = float(rate) if rate else None
+        self.max_concurrent = int(max_concurrent) if max_concurrent else None
+        self.burst = float(burst) if burst else max(1.0, self.rate or 1.0)
+        self.lease_ttl = lease_ttl
+        self.waits = 0
+        self.wait_time = 0.0
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        """One connection per thread (sqlite3 connections are not shared)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+
+        return conn
+
+    @property
+    def stats(self):
+        """Limits and time spent waiting for the shared budget"""
+        return {'key': self.key, 'rate': self.rate,
+                'max_concurrent': self.max_concurrent,
+                'waits': self.waits, 'wait_time': round(self.wait_time, 3)}
+
+    def try_acquire(self):
+        """Take a token and a slot if both are available
+
+        Returns:
+            (lease_id, 0) on success, (None, seconds to wait) otherwise
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM leases WHERE expires < ?', (now,))
+            if self.max_concurrent is not None:
+                in_flight = conn.execute(
+                    'SELECT COUNT(*) FROM leases WHERE key = ?',
+                    (self.key,)).fetchone()[0]
+                if in_flight >= self.max_concurrent:
+                    conn.execute('COMMIT')
+                    return None, 0.05
+
+            if self.rate is not None:
+                row = conn.execute(
+                    'SELECT tokens, updated FROM buckets WHERE key = ?',
+                    (self.key,)).fetchone()
+                tokens = self.burst if row is None else min(
+                    self.burst, row[0] + (now - row[1]) * self.rate)
+                if tokens < 1:
+                    conn.execute('COMMIT')
+                    return None, (1 - tokens) / self.rate
+                conn.execute('INSERT OR REPLACE INTO buckets '
+                             '(key, tokens, updated) VALUES (?, ?, ?)',
+                             (self.key, tokens - 1, now))
+
+            lease_id = uuid.uuid4().hex
+            conn.execute('INSERT INTO leases (id, key, expires) '
+                         'VALUES (?, ?, ?)',
+                         (lease_id, self.key, now + self.lease_ttl))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return lease_id, 0
+
+    def acquire(self):
+        """Wait for a token and a slot, return the lease id"""
+        start = time.time()
+        waited = False
+        while True:
+            lease_id, delay = self.try_acquire()
+            if lease_id is not None:
+                break
+            waited = True
+            time.sleep(delay)
+        if waited:
+            self.waits += 1
+            self.wait_time += time.time() - start
+            g.log.debug('SharedRateLimiter: waited %.3fs for %s',
+                        time.time() - start, self.key)
+
+        return lease_id
+
+    def release(self, lease_id):
+        """Give a slot back"""
+        self._connect().execute('DELETE FROM leases WHERE id = ?',
+                                (lease_id,))
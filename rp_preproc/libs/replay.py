@@ -0,0 +1,232 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Replay spooled ReportPortal operations"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import gzip
+import json
+import os
+import threading
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.spool import SPOOL_OPS, SPOOL_REPLAYED
+
+
+class ReplayError(Exception):
+    """A spooled operation was refused by ReportPortal"""
+
+
+class Replay:
+    """Send spooled launches to ReportPortal.
+
+    Operations are handed to a pool of workers in spool order. Each one
+    waits only for the operations creating the launch or items it refers
+    to, which were submitted before it, so items of different suites go
+    out in parallel while every child still follows its parent. The finish
+    of an item also waits for every operation under it (child starts and
+    finishes, logs). Logs go out in batches through a LogBuffer.
+    """
+    def __init__(self, rportal, workers=8):
+        """Create a replayer
+
+        Args:
+            rportal (obj): ReportPortal instance on the sync API
+            workers (int): operations sent at the same time
+        """
+        self.rportal = rportal
+        self.workers = workers
+        self.logs = rportal.upload_buffer
+        self.stats = {'launches': 0, 'items': 0, 'logs': 0}
+        # spool UUID -> ReportPortal id
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def find_spools(spool_dir):
+        """Get the finished launch spools in a spool directory"""
+        spools = []
+        for entry in sorted(os.scandir(spool_dir), key=lambda e: e.name):
+            if not entry.is_dir() or entry.name == SPOOL_REPLAYED:
+                continue
+            for name in (SPOOL_OPS, SPOOL_OPS + '.gz'):
+                if os.path.exists(os.path.join(entry.path, name)):
+                    spools.append(os.path.join(entry.path, name))
+
+        return spools
+
+    @staticmethod
+    def read_ops(filename):
+        """Read the operations of a spool in order"""
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as opsfd:
+            for line in opsfd:
+                if line.strip():
+                    yield json.loads(line)
+
+    def replay_dir(self, spool_dir):
+        """Replay every finished spool, moving each to replayed/ when done
+
+        Returns:
+            list of the new launch ids
+        """
+        launch_ids = []
+        replayed_dir = os.path.join(spool_dir, SPOOL_REPLAYED)
+        for filename in self.find_spools(spool_dir):
+            launch_ids.append(self.replay(filename))
+            os.makedirs(replayed_dir, exist_ok=True)
+            spool_path = os.path.dirname(filename)
+            os.replace(spool_path, os.path.join(
+                replayed_dir, os.path.basename(spool_path)))
+
+        return launch_ids
+
+    def replay(self, filename):
+        """Replay one launch spool and return the new launch id"""
+        g.log.info('Replaying %s', filename)
+        spool_path = os.path.dirname(filename)
+        # spool UUID -> future of the operation creating it
+        created = {}
+        # spool UUID -> futures of the operations under it
+        children = {}
+        # item spool UUID -> its parent's (or launch's)
+        parents = {}
+        futures = []
+        launch_uuid = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for operation in self.read_ops(filename):
+                if operation['op'] == 'finish_launch':
+                    # everything else has to be in first
+                    wait(futures)
+                    self._raise(futures)
+                    self.logs.flush()
+                depends = [created[operation[key]]
+                           for key in ('parent', 'launch', 'item', 'uuid')
+                           if operation.get(key) in created]
+                if operation['op'] == 'finish_item':
+                    depends.extend(children.pop(operation['uuid'], []))
+                future = executor.submit(self._run, spool_path, operation,
+                                         depends)
+                futures.append(future)
+                if operation['op'] in ('start_launch', 'start_item'):
+                    created[operation['uuid']] = future
+                if operation['op'] == 'start_item':
+                    parents[operation['uuid']] = \
+                        operation['parent'] or operation['launch']
+                    children.setdefault(parents[operation['uuid']],
+                                        []).append(future)
+                elif operation['op'] == 'finish_item':
+                    children.setdefault(parents.pop(operation['uuid'], None),
+                                        []).append(future)
+                elif operation['op'] == 'log':
+                    children.setdefault(
+                        operation['item'] or operation['launch'],
+                        []).append(future)
+                if operation['op'] == 'start_launch':
+                    launch_uuid = operation['uuid']
+        self._raise(futures)
+
+        launch_id = self._ids[launch_uuid]
+        self.rportal.launches.add(launch_id)
+        with self._lock:
+            self._ids = {}
+
+        return launch_id
+
+    @staticmethod
+    def _raise(futures):
+        """Raise the first error of the operations"""
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def _run(self, spool_path, operation, depends):
+        wait(depends)
+        if any(future.exception() is not None for future in depends):
+            # an operation this one needs failed, it is reported there
+            return
+        getattr(self, '_' + operation['op'])(spool_path, operation)
+
+    def _id(self, spool_uuid):
+        return self._ids.get(spool_uuid)
+
+    def _created(self, spool_uuid, response_json, stat):
+        with self._lock:
+            self._ids[spool_uuid] = response_json['id']
+            self.stats[stat] += 1
+
+    def _post(self, api_path, data):
+        response = self.rportal.api_post(api_path, post_data=data)
+        response_json = self.rportal.get_json(response)
+        if response_json is None:
+            raise ReplayError('POST {} failed: {}'.format(api_path,
+                                                          response.text))
+
+        return response_json
+
+    def _put(self, api_path, data):
+        response = self.rportal.api_put(api_path, put_data=data)
+        if not response.ok:
+            raise ReplayError('PUT {} failed: {}'.format(api_path,
+                                                         response.text))
+
+    # pylint: disable=unused-argument
+    def _start_launch(self, spool_path, operation):
+        data = {key: operation[key] for key in
+                ('name', 'start_time', 'description', 'tags', 'mode')}
+        self._created(operation['uuid'], self._post('launch', data),
+                      'launches')
+
+    def _update_launch(self, spool_path, operation):
+        data = {key: operation[key] for key in ('description', 'tags')
+                if operation[key] is not None}
+        self._put('launch/{}/update'.format(self._id(operation['uuid'])),
+                  data)
+
+    def _finish_launch(self, spool_path, operation):
+        self._put('launch/{}/finish'.format(self._id(operation['uuid'])),
+                  {'end_time': operation['end_time'],
+                   'status': operation['status']})
+
+    def _start_item(self, spool_path, operation):
+        parameters = operation['parameters']
+        if parameters is not None:
+            parameters = [{'key': key, 'value': str(value)}
+                          for key, value in parameters.items()]
+        data = {'name': operation['name'],
+                'description': operation['description'],
+                'tags': operation['tags'],
+                'start_time': operation['start_time'],
+                'launch_id': self._id(operation['launch']),
+                'type': operation['type'], 'parameters': parameters}
+        api_path = 'item'
+        if operation['parent'] is not None:
+            api_path = 'item/{}'.format(self._id(operation['parent']))
+        self._created(operation['uuid'], self._post(api_path, data), 'items')
+
+    def _finish_item(self, spool_path, operation):
+        self._put('item/{}'.format(self._id(operation['uuid'])),
+                  {'end_time': operation['end_time'],
+                   'status': operation['status'],
+                   'issue': operation['issue']})
+
+    def _log(self, spool_path, operation):
+        filepath = None
+        if operation.get('file'):
+            filepath = os.path.join(spool_path, operation['file'])
+        self.logs.add(self._id(operation['item'] or operation['launch']),
+                      operation['message'], level=operation['level'],
+                      msg_time=operation['time'], filepath=filepath)
+        with self._lock:
+            self.stats['logs'] += 1
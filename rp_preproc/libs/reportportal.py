@@ -14,35 +14,54 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 #
 """ReportPortal class for RP PreProc client and service"""
+from concurrent.futures import ThreadPoolExecutor
 import json
-from mimetypes import guess_type
 import os
+import pathlib
 import posixpath
 import re
+import shutil
+import threading
 import time
 import uuid
 from zipfile import ZipFile
 
-import requests
 import urllib3
 
 from glusto.core import Glusto as g
 from reportportal_client import ReportPortalService
+from rp_preproc.libs.attachments import AttachmentDedup, \
+    AttachmentPolicy, DEFAULT_CACHE_ENTRIES, guess_mime, MultipartStream
+from rp_preproc.libs.configs import Configs
+from rp_preproc.libs.rp_aio import AioEngine, DEFAULT_MAX_IN_FLIGHT
+from rp_preproc.libs.rp_async import AsyncDispatcher, \
+    AsyncReportPortalService, DEFAULT_ASYNC_WORKERS
+from rp_preproc.libs.sessions import SESSIONS, DEFAULT_POOL_SIZE
+from rp_preproc.libs.spool import SpoolService
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+DEFAULT_LOG_BATCH_SIZE = 20
+DEFAULT_LOG_BATCH_BYTES = 16 * 1024 * 1024
+DEFAULT_UPLOAD_WORKERS = 4
+
 
 class ReportPortal:
     """ReportPortal class to assist with RP API calls"""
     def __init__(self, config, endpoint=None, api_token=None, project=None,
-                 merge_launches=None, rpuid=None):
+                 merge_launches=None, rpuid=None, api_mode=None,
+                 spool_dir=None):
         """Create a ReportPortal client instance
 
         Args:
             config (str): the reportportal config section from file
+            api_mode (str): override the api_mode of the config
+            spool_dir (str): spool operations here instead of sending them
         """
         self._rpuid = rpuid
+        self._api_mode = api_mode
+        self._spool_dir = spool_dir
         self._service = None
         self._config = config
         self._endpoint = endpoint
@@ -50,6 +69,12 @@ class ReportPortal:
         self._project = project
         self._merge_launches = merge_launches
         self._launches = Launches(self)
+        self._rplog = None
+        self._log_buffer = None
+        self._upload_buffer = None
+        self._attachment_dedup = None
+        self._attachment_policy = None
+        self._dispatcher = None
 
     @property
     def rpuid(self):
@@ -100,21 +125,252 @@ class ReportPortal:
     def service(self):
         """get service"""
         # creating service on first call to get service
-        if self._service is None:
+        if self._service is None and self.api_mode == 'spool':
+            self._service = SpoolService(
+                self.spool_dir,
+                compress=self.config.get('spool_compress', False))
+        elif self._service is None and self.api_mode == 'async':
+            self._service = AsyncReportPortalService(self.endpoint,
+                                                     self.project,
+                                                     self.dispatcher)
+        elif self._service is None:
             self._service = ReportPortalService(endpoint=self.endpoint,
                                                 project=self.project,
                                                 token=self.api_token)
-            self._service.session.verify = False
+            # report through the shared connection pool
+            self._service.session = self.session
 
             # TODO: validate the service works
 
         return self._service
 
+    @property
+    def api_mode(self):
+        """Report items through the 'sync' (v1) or 'async' (v2) API, or
+        'spool' them for replaying later"""
+        if self._api_mode is None:
+            self._api_mode = 'spool' if self.spool_dir else \
+                self.config.get('api_mode',
+                                os.environ.get('RP_API_MODE', 'sync'))
+
+        return self._api_mode
+
+    @property
+    def spool_dir(self):
+        """Directory operations are spooled to in spool mode"""
+        if self._spool_dir is None:
+            self._spool_dir = self.config.get('spool_dir',
+                                              os.environ.get('RP_SPOOL_DIR',
+                                                             None))
+
+        return self._spool_dir
+
+    @property
+    def async_engine(self):
+        """Send async API requests from 'threads' or an 'asyncio' loop"""
+        return self.config.get('async_engine',
+                               os.environ.get('RP_ASYNC_ENGINE', 'threads'))
+
+    @property
+    def dispatcher(self):
+        """AsyncDispatcher or AioEngine shared with clones, for the async
+        API mode"""
+        if self._dispatcher is None and self.async_engine == 'asyncio':
+            self._dispatcher = AioEngine(
+                self.api_token, self.session.controller,
+                max_in_flight=int(self.config.get('max_in_flight',
+                                                  DEFAULT_MAX_IN_FLIGHT)),
+                keep_alive=self.keep_alive)
+        elif self._dispatcher is None:
+            self._dispatcher = AsyncDispatcher(
+                self.session,
+                max_workers=int(self.config.get('async_workers',
+                                                DEFAULT_ASYNC_WORKERS)))
+
+        return self._dispatcher
+
+    @property
+    def session(self):
+        """Pooled session shared by everything using the same endpoint,
+        project and token"""
+        return SESSIONS.get(self.endpoint, self.project, self.api_token,
+                            pool_size=self.pool_size,
+                            keep_alive=self.keep_alive,
+                            controller=self.config.get('controller'))
+
+    @property
+    def pool_size(self):
+        """Connections kept open to the ReportPortal server"""
+        return int(self.config.get('pool_size',
+                                   os.environ.get('RP_POOL_SIZE',
+                                                  DEFAULT_POOL_SIZE)))
+
+    @property
+    def keep_alive(self):
+        """Keep connections to the ReportPortal server open between calls"""
+        return Configs.get_bool(
+            self.config.get('keep_alive',
+                            os.environ.get('RP_KEEP_ALIVE', True)))
+
+    @property
+    def rplog(self):
+        """RpLog shared by all testcases reported through this instance"""
+        if self._rplog is None:
+            self._rplog = RpLog(self)
+
+        return self._rplog
+
+    @property
+    def log_batch_size(self):
+        """Log entries sent per batch (1 sends every entry on its own)"""
+        return int(self.config.get('log_batch_size',
+                                   os.environ.get('RP_LOG_BATCH_SIZE',
+                                                  DEFAULT_LOG_BATCH_SIZE)))
+
+    @property
+    def log_batch_bytes(self):
+        """Message and attachment bytes sent per batch"""
+        return int(self.config.get('log_batch_bytes',
+                                   os.environ.get('RP_LOG_BATCH_BYTES',
+                                                  DEFAULT_LOG_BATCH_BYTES)))
+
+    @property
+    def upload_workers(self):
+        """Log batches (with their attachments) uploaded in parallel"""
+        return int(self.config.get('upload_workers',
+                                   os.environ.get('RP_UPLOAD_WORKERS',
+                                                  DEFAULT_UPLOAD_WORKERS)))
+
+    @property
+    def log_buffer(self):
+        """LogBuffer shared with clones (None when batching is off)"""
+        if self._log_buffer is None and self.log_batch_size > 1 and \
+                self.api_mode != 'spool':
+            self._log_buffer = LogBuffer(self,
+                                         batch_size=self.log_batch_size,
+                                         batch_bytes=self.log_batch_bytes,
+                                         workers=self.upload_workers)
+
+        return self._log_buffer
+
+    @property
+    def upload_buffer(self):
+        """LogBuffer attachments are streamed through, shared with clones:
+        the log_buffer, or one sending every attachment on its own when
+        batching is off (None when spooling)"""
+        if self._upload_buffer is None and self.api_mode != 'spool':
+            self._upload_buffer = self.log_buffer or \
+                LogBuffer(self, batch_size=1, workers=self.upload_workers)
+
+        return self._upload_buffer
+
+    @property
+    def dedup_attachments(self):
+        """Upload attachments with the same contents only once"""
+        return Configs.get_bool(
+            self.config.get('dedup_attachments',
+                            os.environ.get('RP_DEDUP_ATTACHMENTS', False)))
+
+    @property
+    def attachment_cache(self):
+        """File keeping the references of uploaded attachments between runs
+        (implies dedup_attachments)"""
+        return self.config.get('attachment_cache',
+                               os.environ.get('RP_ATTACHMENT_CACHE', None))
+
+    @property
+    def attachment_dedup(self):
+        """AttachmentDedup shared with clones (None when dedup is off or
+        when spooling, whose items only get their ids on replay)"""
+        if self._attachment_dedup is None and self.api_mode != 'spool' and \
+                (self.dedup_attachments or self.attachment_cache):
+            self._attachment_dedup = AttachmentDedup(
+                posixpath.join(self.endpoint, self.project),
+                cache_file=self.attachment_cache,
+                max_entries=int(self.config.get(
+                    'attachment_cache_size',
+                    os.environ.get('RP_ATTACHMENT_CACHE_SIZE',
+                                   DEFAULT_CACHE_ENTRIES))))
+
+        return self._attachment_dedup
+
+    @property
+    def attachment_policy(self):
+        """AttachmentPolicy shared with clones (None when the config has no
+        attachment_policy)"""
+        if self._attachment_policy is None and \
+                self.config.get('attachment_policy'):
+            self._attachment_policy = AttachmentPolicy(
+                self.config['attachment_policy'])
+
+        return self._attachment_policy
+
+    def item_url(self, launch_id, item_id):
+        """Link to the logs of a test item in the ReportPortal UI"""
+        return posixpath.join(self.endpoint, 'ui',
+                              '#{}'.format(self.project), 'launches', 'all',
+                              str(launch_id), str(item_id), 'log')
+
     @property
     def launches(self):
         """launch list attr getter"""
         return self._launches
 
+    def clone(self):
+        """Create an instance with the same config, rpuid and launch list
+        but its own service, so it can import from another thread"""
+        rportal = ReportPortal(self.config, endpoint=self._endpoint,
+                               api_token=self._api_token,
+                               project=self._project,
+                               merge_launches=self._merge_launches,
+                               rpuid=self.rpuid, api_mode=self._api_mode,
+                               spool_dir=self._spool_dir)
+        rportal._launches = self.launches
+        rportal._log_buffer = self.log_buffer
+        rportal._upload_buffer = self.upload_buffer
+        rportal._attachment_dedup = self.attachment_dedup
+        rportal._attachment_policy = self.attachment_policy
+        if self.api_mode == 'async':
+            # dependencies are only tracked within one dispatcher
+            rportal._dispatcher = self.dispatcher
+
+        return rportal
+
+    def fork(self):
+        """Create a clone whose service reports under the launch and test
+        item this instance's service is currently positioned at"""
+        rportal = self.clone()
+        rportal.service.launch_id = self.service.launch_id
+        rportal.service.stack = list(self.service.stack)
+
+        return rportal
+
+    def close(self):
+        """Stop the async dispatcher, save the attachment cache and remove
+        the attachment copies (once all clones are done)"""
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+        if self._attachment_dedup is not None:
+            self._attachment_dedup.save()
+        if self._attachment_policy is not None:
+            self._attachment_policy.cleanup()
+
+    @staticmethod
+    def get_json(response):
+        """Get the JSON body of a successful response (None otherwise)"""
+        if not response.ok:
+            g.log.error('%s %s failed (%s): %s', response.request.method,
+                        response.url, response.status_code, response.text)
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            g.log.error('%s returned no JSON: %s', response.url,
+                        response.text)
+
+        return None
+
     @property
     def merge_launches(self):
         """Should launches be merged?"""
@@ -136,14 +392,10 @@ class ReportPortal:
         url = posixpath.join(self.endpoint, 'api/v1/', self.project, api_path)
         g.log.debug('url: %s', url)
 
-        session = requests.Session()
-        session.headers["Authorization"] = "bearer {0}".format(self.api_token)
-
-
-        session.headers["Content-type"] = "application/json"
-        session.headers["Accept"] = "application/json"
-        response = session.put(url, data=json.dumps(put_data),
-                               verify=verify)
+        headers = {"Content-type": "application/json",
+                   "Accept": "application/json"}
+        response = self.session.put(url, data=json.dumps(put_data),
+                                    headers=headers, verify=verify)
 
         g.log.debug('r.status_code: %s', response.status_code)
         g.log.debug('r.text: %s', response.text)
@@ -166,11 +418,8 @@ class ReportPortal:
             url += get_string
         g.log.debug('url: %s', url)
 
-        session = requests.Session()
-        session.headers["Authorization"] = "bearer {0}".format(self.api_token)
-        session.headers["Accept"] = "application/json"
-
-        response = session.get(url, verify=verify)
+        headers = {"Accept": "application/json"}
+        response = self.session.get(url, headers=headers, verify=verify)
 
         g.log.debug('r.status_code: %s', response.status_code)
         g.log.debug('r.text: %s', response.text)
@@ -183,30 +432,46 @@ class ReportPortal:
         url = posixpath.join(self.endpoint, 'api/v1/', self.project, api_path)
         g.log.debug('url: %s', url)
 
-        session = requests.Session()
-        session.headers["Authorization"] = "bearer {0}".format(self.api_token)
-
         if filepath is None:
-            session.headers["Content-type"] = "application/json"
-            session.headers["Accept"] = "application/json"
-            response = session.post(url, data=json.dumps(post_data),
-                                    verify=verify)
+            headers = {"Content-type": "application/json",
+                       "Accept": "application/json"}
+            response = self.session.post(url, data=json.dumps(post_data),
+                                         headers=headers, verify=verify)
         else:
-            files = {'file': open(filepath, 'rb')}
-            response = session.post(url, data={}, files=files, verify=False)
+            with open(filepath, 'rb') as postfd:
+                files = {'file': postfd}
+                response = self.session.post(url, data={}, files=files,
+                                             verify=False)
 
         g.log.debug('r.status_code: %s', response.status_code)
         g.log.debug('r.text: %s', response.text)
 
         return response
 
-    def api_post_zipfile(self, infile, outfile='/tmp/myresults.zip'):
-        """POST a single zip file to the ReportPortal API"""
+    def api_post_zipfile(self, infile, outfile=None, xmlfd=None,
+                         arcname=None):
+        """POST a single zip file to the ReportPortal API
+
+        Args:
+            infile (str): path of the xml file to zip
+            outfile (str): path of the zip file (default: unique tmp file)
+            xmlfd (obj): binary file object to zip instead of reading
+                infile, e.g. a decompressing reader
+            arcname (str): name of the xml inside the zip when using xmlfd
+        """
+        if outfile is None:
+            outfile = os.path.join('/tmp',
+                                   'rppp_{}.zip'.format(uuid.uuid1().hex))
         with ZipFile(outfile, 'w') as zipit:
-            zipit.write(infile)
+            if xmlfd is None:
+                zipit.write(infile)
+            else:
+                with zipit.open(arcname, 'w') as zipfd:
+                    shutil.copyfileobj(xmlfd, zipfd)
         api_path = 'launch/import'
 
         response = self.api_post(api_path, filepath=outfile)
+        os.remove(outfile)
         #response_json = response.json()
 
         try:
@@ -230,6 +495,7 @@ class Launches:
     def __init__(self, rportal):
         self._rportal = rportal
         self._list = []
+        self._lock = threading.Lock()
 
     @property
     def list(self):
@@ -237,8 +503,9 @@ class Launches:
         return self._list
 
     def add(self, launch_id):
-        """Add a launch to the list"""
-        self.list.append(launch_id)
+        """Add a launch to the list (safe to call from import workers)"""
+        with self._lock:
+            self.list.append(launch_id)
 
     def merge(self, name='Merged Launch', description='merged launches',
               merge_type='BASIC'):
@@ -355,6 +622,30 @@ class Launch:
 
         return self._end_time
 
+    def append_description(self, text):
+        """Add a paragraph to the description before the launch starts"""
+        self._description = '{}\n\n{}'.format(self.description, text)
+
+    def update(self, description=None, tags=None):
+        """Update the description and/or tags of the started launch"""
+        update_data = {}
+        if description is not None:
+            self._description = description
+            update_data['description'] = description
+        if tags is not None:
+            self._tags = tags
+            update_data['tags'] = tags
+
+        if self._rportal.api_mode in ('spool', 'async'):
+            # queued with the launch's other requests
+            self._service.update_launch(description=description, tags=tags)
+            return None
+
+        api_path = 'launch/{}/update'.format(self._launch_id)
+        response = self._rportal.api_put(api_path, put_data=update_data)
+
+        return response.status_code
+
     def start(self, start_time=None):
         """Start a launch
 
@@ -388,11 +679,26 @@ class Launch:
         # TODO: UMB integration (here @ launch and start finish???)
         # TODO: set launch id class attr
 
+    def resume(self, launch_id):
+        """Continue reporting into a launch started by an earlier run
+
+        Args:
+            launch_id (str): the id start() returned back then
+        """
+        g.log.debug('Resuming launch %s', launch_id)
+        self._launch_id = launch_id
+        self._service.launch_id = launch_id
+        self._service.stack.append(None)
+
+        return self._launch_id
+
     def finish(self, end_time=None):
         """Finish the launch"""
         if end_time is not None:
             self._end_time = end_time
 
+        # logs still buffered must be in before the launch closes
+        self._rportal.rplog.flush()
         self._service.finish_launch(end_time=self.end_time)
         g.log.debug('time elapsed = %s - %s', self.end_time, self.start_time)
         time_elapsed = int(self.end_time) - int(self.start_time)
@@ -418,34 +724,312 @@ class TestItem:
     # TODO: move the logic for this from the other class methods
 
 
+class LogBuffer:
+    """Collect log entries and send them through the batch log endpoint.
+
+    The test item of an entry is taken when it is added, so one buffer can
+    be shared by all the services of an import (shards, jobs) and flushed
+    whenever it fills up. Attachments are only read when sent. A callback
+    added with add_callback() runs once every entry added before it is in
+    ReportPortal.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, rportal, batch_size=DEFAULT_LOG_BATCH_SIZE,
+                 batch_bytes=DEFAULT_LOG_BATCH_BYTES, workers=1):
+        """Create a buffer
+
+        Args:
+            rportal (obj): ReportPortal instance to send through
+            batch_size (int): entries per batch
+            batch_bytes (int): message and attachment bytes per batch
+            workers (int): batches uploaded in parallel on the sync API
+                (1 sends from the thread filling the batch)
+        """
+        self._rportal = rportal
+        self._async = rportal.api_mode == 'async'
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.workers = workers
+        # at most two batches waiting per worker, the rest waits in add()
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(2 * workers)
+        self._uploads = set()
+        self.batches = 0
+        self.entries = 0
+        self._entries = []
+        self._callbacks = []
+        self._bytes = 0
+        # batches are numbered when taken and confirmed in that order
+        self._taken = 0
+        self._confirmed = 0
+        self._done = set()
+        self._waiting = {}
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def add(self, item_id, message, level='INFO', msg_time=None,
+            filepath=None, launch_id=None):
+        """Add a log entry, sending the batch once it is full
+
+        Args:
+            item_id (str): test item (or launch) the entry belongs to
+            filepath (str): file to attach to the entry
+            launch_id (str): launch of the item (needed by the async API)
+        """
+        if msg_time is None:
+            msg_time = str(int(time.time() * 1000))
+        if self._async:
+            entry = {'launchUuid': launch_id, 'itemUuid': item_id,
+                     'time': msg_time, 'message': message, 'level': level}
+        else:
+            entry = {'item_id': item_id, 'time': msg_time,
+                     'message': message, 'level': level}
+        # batches are limited in bytes on the wire, not characters
+        size = len(message.encode('utf8')) if message else 0
+        if filepath is not None:
+            size += os.path.getsize(filepath)
+
+        batch = None
+        with self._lock:
+            if self._entries and self._bytes + size > self.batch_bytes:
+                batch = self._take()
+            self._entries.append((entry, filepath))
+            self._bytes += size
+            if batch is None and len(self._entries) >= self.batch_size:
+                batch = self._take()
+        if batch:
+            self._send(*batch)
+
+    def add_callback(self, callback):
+        """Call callback once the entries added so far are sent"""
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def flush(self):
+        """Send everything buffered so far"""
+        with self._lock:
+            batch = None
+            if self._entries or self._callbacks:
+                batch = self._take()
+        if batch is not None:
+            self._send(*batch)
+
+        # wait for the parallel uploads, raising what failed in them
+        with self._lock:
+            uploads = list(self._uploads)
+        for future in uploads:
+            future.result()
+
+    def _take(self):
+        self._taken += 1
+        batch = (self._taken, self._entries, self._callbacks)
+        self._entries = []
+        self._callbacks = []
+        self._bytes = 0
+
+        return batch
+
+    def _confirm(self, number, callbacks, sent):
+        """Run the callbacks of all batches up to the last one in order"""
+        ready = []
+        with self._lock:
+            self._failed = self._failed or not sent
+            self._done.add(number)
+            if callbacks:
+                self._waiting[number] = callbacks
+            while self._confirmed + 1 in self._done:
+                self._confirmed += 1
+                self._done.remove(self._confirmed)
+                ready.extend(self._waiting.pop(self._confirmed, []))
+            if self._failed:
+                # the entries of a failed batch are lost, so nothing after
+                # it counts as sent
+                ready = []
+                self._waiting = {}
+        for callback in ready:
+            callback()
+
+    def _send(self, number, batch, callbacks):
+        if not batch:
+            self._confirm(number, callbacks, True)
+            return
+
+        files = self._multipart(batch)
+        url = posixpath.join(self._rportal.service.base_url, 'log')
+        self.batches += 1
+        self.entries += len(batch)
+        if self._async:
+            # queue behind the items of the batch instead of waiting
+            entries = [entry for entry, _ in batch]
+            items = {entry['itemUuid'] for entry in entries}
+            future = self._rportal.dispatcher.submit(
+                {entry['launchUuid'] for entry in entries}, 'POST', url,
+                depends=items, files=files, parents=items)
+            future.add_done_callback(
+                lambda future: self._confirm(number, callbacks,
+                                             future.exception() is None))
+            return
+
+        if self.workers <= 1:
+            self._post(url, files, number, len(batch), callbacks)
+            return
+
+        self._slots.acquire()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='rp_uploads')
+            future = self._executor.submit(self._post, url, files, number,
+                                           len(batch), callbacks)
+            self._uploads.add(future)
+        future.add_done_callback(self._uploaded)
+
+    def _uploaded(self, future):
+        self._slots.release()
+        if future.exception() is None:
+            with self._lock:
+                self._uploads.discard(future)
+
+    def _post(self, url, files, number, entries, callbacks):
+        """Send a batch, streaming the attachments from disk"""
+        body = MultipartStream(files)
+        try:
+            response = self._rportal.session.post(
+                url, data=body, headers={'Content-Type': body.content_type},
+                verify=False)
+        except OSError:
+            self._confirm(number, callbacks, False)
+            raise
+        finally:
+            body.close()
+        g.log.debug('LogBuffer: sent %s log entries (%s)', entries,
+                    response.status_code)
+        if not response.ok:
+            g.log.error('LogBuffer: batch of %s log entries failed: %s',
+                        entries, response.text)
+        self._confirm(number, callbacks, response.ok)
+
+    @staticmethod
+    def _multipart(batch):
+        """Build the multipart body of the batch log endpoint"""
+        log_data = []
+        files = []
+        for entry, filepath in batch:
+            if filepath is not None:
+                filename = os.path.basename(filepath)
+                entry['file'] = {'name': filename}
+                files.append(('file', (filename, pathlib.Path(filepath),
+                                       guess_mime(filepath) or
+                                       'application/octet-stream')))
+            log_data.append(entry)
+        files.insert(0, ('json_request_part',
+                         (None, json.dumps(log_data), 'application/json')))
+
+        return files
+
+
 class RpLog:
     """Log an event in ReportPortal.
     ReportPortal works with the concept of "logging" results"""
     def __init__(self, rportal):
         self.service = rportal.service
+        self.buffer = rportal.log_buffer
+        self.uploads = rportal.upload_buffer
+        self.dedup = rportal.attachment_dedup
+        self.policy = rportal.attachment_policy
+        self.item_url = rportal.item_url
 
-    def add_attachment(self, filepath):
-        """Add an attachment to a testcase in ReportPortal"""
+    @property
+    def item_id(self):
+        """Test item (or launch) the service is currently positioned at"""
+        return self.service.stack[-1] or self.service.launch_id
+
+    def flush(self):
+        """Send any buffered log entries and attachments"""
+        if self.uploads is not None:
+            self.uploads.flush()
+
+    def on_sent(self, callback):
+        """Call callback once the messages and attachments added so far
+        are in ReportPortal"""
+        if self.uploads is not None:
+            self.uploads.add_callback(callback)
+        else:
+            callback()
+
+    def add_attachment(self, filepath, budget=None):
+        """Add an attachment to a testcase in ReportPortal
+
+        Args:
+            filepath (str): the attachment
+            budget (dict): AttachmentPolicy budget of the testcase
+        """
+        # duplicates are found by the contents of the original, before
+        # the policy makes a copy of it
+        key = None
+        if self.dedup is not None:
+            filename = os.path.basename(filepath)
+            key, first = self.dedup.claim(filepath, {
+                'name': filename, 'launch': self.service.launch_id,
+                'item': self.item_id,
+                'url': self.item_url(self.service.launch_id, self.item_id)})
+            if first is not None:
+                g.log.debug('%s was already uploaded as %s', filepath,
+                            first['url'])
+                self.add_message(self.dedup.message(filename, first))
+                return
+        if self.policy is not None:
+            original = filepath
+            filepath, note = self.policy.apply(filepath, budget)
+            if note is not None:
+                g.log.debug('%s: %s', original, note)
+                self.add_message(note, level='WARN' if filepath is None
+                                 else 'INFO')
+            if filepath is None:
+                if key is not None:
+                    self.dedup.release(key)
+                return
         filename = os.path.basename(filepath)
         g.log.debug('Attaching %s', filepath)
-        with open(filepath, "rb") as fh:
-            attachment = {
-                "name": filename,
-                "data": fh.read(),
-                "mime": guess_type(filepath)[0]
-            }
-            self.service.log(str(int(time.time() * 1000)),
-                             filename, "INFO", attachment)
+        size = os.path.getsize(filepath)
+
+        def sent():
+            if key is not None:
+                self.dedup.sent(key)
+            if self.policy is not None:
+                self.policy.sent(size)
+
+        if self.uploads is not None:
+            # streamed from disk when the batch is sent
+            self.uploads.add(self.item_id, filename, filepath=filepath,
+                             launch_id=self.service.launch_id)
+            self.uploads.add_callback(sent)
+            return
+        # the spool copies the file
+        attachment = {
+            "name": filename,
+            "data": pathlib.Path(filepath),
+            "mime": guess_mime(filepath)
+        }
+        self.service.log(str(int(time.time() * 1000)),
+                         filename, "INFO", attachment)
+        sent()
         # FIXME: return True/False
 
-    def add_attachments(self, fqpath, xml_name, tc_attach_dir):
-        """Add attachments from testcase directory
+    @staticmethod
+    def get_attachments(fqpath, xml_name, tc_attach_dir):
+        """Get the attachment files in a testcase directory
 
         Args:
             fqpath (str): fullpath to attachments base dir
             xml_name (str): name from the xml file
             tc_attach_dir (str): testcase attachment subdirectory
+
+        Returns:
+            list of attachment file paths
         """
+        attachments = []
         basepath = os.path.join(fqpath, tc_attach_dir)
         xml_dirpath = os.path.join(fqpath, xml_name, tc_attach_dir)
 
@@ -455,12 +1039,40 @@ class RpLog:
                     for file in files:
                         file_name = os.path.join(root, file)
                         g.log.debug('file_name')
-                        self.add_attachment(file_name)
+                        attachments.append(file_name)
+
+        return attachments
+
+    def add_attachments(self, fqpath, xml_name, tc_attach_dir):
+        """Add attachments from testcase directory
+
+        Args:
+            fqpath (str): fullpath to attachments base dir
+            xml_name (str): name from the xml file
+            tc_attach_dir (str): testcase attachment subdirectory
+        """
+        self.add_testcase_attachments(
+            RpLog.get_attachments(fqpath, xml_name, tc_attach_dir))
         # FIXME: return list of attached files or None
 
+    def add_testcase_attachments(self, filepaths):
+        """Add the attachments of one testcase (counted together against
+        the attachment policy's testcase cap)"""
+        budget = None if self.policy is None else self.policy.budget()
+        for filepath in filepaths:
+            self.add_attachment(filepath, budget=budget)
+
     def add_message(self, message='N/A', level='INFO',
                     msg_time=None):
         """Log a message in ReportPortal"""
+        if message is None:
+            # e.g. <failure type="X"/> has no message text
+            message = 'N/A'
+        if self.buffer is not None:
+            self.buffer.add(self.item_id, message, level=level,
+                            msg_time=msg_time,
+                            launch_id=self.service.launch_id)
+            return
         if msg_time is None:
             msg_time = str(int(time.time() * 1000))
         self.service.log(time=msg_time,
@@ -514,9 +1126,9 @@ class Filter:
         api_path = 'filter'
         get_string = 'filter.eq.name={}'.format(self._name)
         response = self._rportal.api_get(api_path, get_data=[get_string])
-        response_json = response.json()
+        response_json = ReportPortal.get_json(response)
         g.log.debug('GET FILTER ID BY NAME: %s', response_json)
-        if response_json['content']:
+        if response_json and response_json.get('content'):
             response_filter = response_json['content'][0]
             filter_id = response_filter['id']
 
@@ -577,9 +1189,9 @@ class Widget:
         api_path = 'widget/shared/search'
         get_string = 'term={}'.format(self._name)
         response = self._rportal.api_get(api_path, get_data=[get_string])
-        response_json = response.json()
+        response_json = ReportPortal.get_json(response)
         g.log.debug('GET WIDGET ID BY NAME: %s', response_json)
-        if response_json['content']:
+        if response_json and response_json.get('content'):
             response_widget = response_json['content'][0]
             widget_id = response_widget['id']
             g.log.debug('RETURNING EXISTING WIDGET: %s', widget_id)
@@ -744,9 +1356,9 @@ class Dashboard:
         api_path = 'dashboard/shared'
         #get_string = 'search?term=={}-table'.format(self._name)
         response = self._rportal.api_get(api_path)
-        response_json = response.json()
+        response_json = ReportPortal.get_json(response)
         g.log.debug('GET DASHBOARD ID BY NAME: %s', response_json)
-        if response_json['content']:
+        if response_json and response_json.get('content'):
             for dashboard in response_json['content']:
                 dashboard_id = dashboard.get('id', None)
                 dashboard_name = dashboard.get('name', None)
@@ -759,7 +1371,7 @@ class Dashboard:
         """Get info about dashboard using the id"""
         api_path = 'dashboard/{}'.format(self._id)
         response = self._rportal.api_get(api_path)
-        response_json = response.json()
+        response_json = ReportPortal.get_json(response)
         g.log.debug('GET DASHBOARD ID BY NAME: %s', response_json)
 
         return response_json
@@ -814,8 +1426,8 @@ class Dashboard:
         g.log.debug('BREAKPOINT 1')
 
         api_path = 'dashboard/{}'.format(self._id)
-        dashboard_info = self.get_info_by_id()
-        widgets = dashboard_info.get('widgets', None)
+        dashboard_info = self.get_info_by_id() or {}
+        widgets = dashboard_info.get('widgets') or []
         g.log.debug(widgets)
         for widget in widgets:
             g.log.debug(widget)
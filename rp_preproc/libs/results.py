@@ -0,0 +1,289 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Compact intermediate representation of parsed xUnit results"""
+from array import array
+import math
+import os
+
+
+STATUSES = ('PASSED', 'FAILED', 'SKIPPED')
+
+# bump when parsing or the TestResults layout changes (invalidates caches)
+PARSER_VERSION = 3
+
+# kinds of entries in TestResults.order
+EVENT_TESTCASE = 0
+EVENT_TESTSUITE = 1
+EVENT_TESTSUITE_END = 2
+
+
+def _get_time(value):
+    """Convert a testcase time attribute to seconds (None if not usable)"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_message(element):
+    """Get the message text of a failure, error or skipped element"""
+    if isinstance(element, dict):
+        return element.get('@message', element.get('#text'))
+
+    return element
+
+
+class SuiteRecord:
+    """A testsuite as needed for reporting"""
+    __slots__ = ('name', 'failures', 'errors')
+
+    def __init__(self, name, failures=0, errors=0):
+        self.name = name
+        self.failures = failures
+        self.errors = errors
+
+    @classmethod
+    def from_dict(cls, testsuite):
+        """Create a record from an xmltodict style testsuite"""
+        return cls(testsuite.get('@name', testsuite.get('@id', 'NULL')),
+                   failures=int(testsuite.get('@failures', '0')),
+                   errors=int(testsuite.get('@errors', '0')))
+
+    @property
+    def status(self):
+        """Status of the testsuite"""
+        if self.failures > 0 or self.errors > 0:
+            return 'FAILED'
+
+        return 'PASSED'
+
+
+class SpilledOutput:
+    """system-out or system-err text too large to keep in memory.
+
+    The parser writes the text to a gzip file as it reads it and keeps
+    only its size and the head and tail for an excerpt.
+    """
+    __slots__ = ('name', 'path', 'size', 'head', 'tail')
+
+    def __init__(self, name, path, size, head, tail):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.head = head
+        self.tail = tail
+
+    def excerpt(self):
+        """Log message standing in for the text"""
+        return '{}\n\n[... {} characters of {}, attached as {} ...]\n\n{}' \
+            .format(self.head, self.size, self.name,
+                    os.path.basename(self.path), self.tail)
+
+
+class TestCaseRecord:
+    """A testcase as needed for reporting
+
+    time is @time in seconds for the statistics, time_text the attribute
+    as written, for the item description.
+    """
+    __slots__ = ('name', 'classname', 'time', 'time_text', 'status',
+                 'message', 'system_out', 'system_err')
+
+    def __init__(self, name, classname='', time=None, status='PASSED',
+                 message=None, system_out=None, system_err=None,
+                 time_text=None):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.classname = classname
+        self.time = time
+        self.time_text = time_text
+        self.status = status
+        self.message = message
+        self.system_out = system_out
+        self.system_err = system_err
+
+    @classmethod
+    def from_dict(cls, testcase):
+        """Create a record from an xmltodict style testcase"""
+        record = cls(testcase.get('@name', testcase.get('@id', None)),
+                     classname=testcase.get('@classname', ''),
+                     time=_get_time(testcase.get('@time')),
+                     system_out=testcase.get('system-out'),
+                     system_err=testcase.get('system-err'),
+                     time_text=testcase.get('@time'))
+
+        # Indicate type of test case (skipped, failures, passed)
+        if testcase.get('skipped'):
+            record.status = 'SKIPPED'
+            record.message = _get_message(testcase.get('skipped'))
+        elif testcase.get('failure') or testcase.get('error'):
+            record.status = 'FAILED'
+            failures = testcase.get('failure', testcase.get('error'))
+            if isinstance(failures, list):
+                record.message = ''.join(
+                    '{msg}\n'.format(msg=_get_message(failure))
+                    for failure in failures)
+            else:
+                record.message = _get_message(failures)
+
+        return record
+
+
+class StringTable:
+    """Strings stored once and referenced by integer offset (-1 is None)"""
+    __slots__ = ('_strings', '_index')
+
+    def __init__(self):
+        self._strings = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getstate__(self):
+        # the intern index is rebuilt on demand, no need to ship it
+        return self._strings
+
+    def __setstate__(self, strings):
+        self._strings = strings
+        self._index = None
+
+    def add(self, value, intern=False):
+        """Store a string and return its offset
+
+        Args:
+            value (str): the string (or a SpilledOutput), or None
+            intern (bool): reuse the offset of an identical stored string
+        """
+        if value is None:
+            return -1
+
+        if intern:
+            if self._index is None:
+                self._index = {}
+            offset = self._index.get(value)
+            if offset is not None:
+                return offset
+            self._index[value] = len(self._strings)
+
+        self._strings.append(value)
+
+        return len(self._strings) - 1
+
+    def get(self, offset):
+        """Get the string stored at an offset"""
+        if offset < 0:
+            return None
+
+        return self._strings[offset]
+
+
+class TestResults:
+    """Column store of the testsuites and testcases parsed from one file.
+
+    Testcases are kept as parallel arrays (name, classname, time, status,
+    message, system-out and system-err offsets into one string table)
+    instead of one dictionary per testcase. The whole object pickles to
+    plain arrays and a list of strings, so it is cheap to hand to another
+    process.
+    """
+    def __init__(self):
+        self.strings = StringTable()
+        self.suites = []
+        self.order = array('l')
+        self.suite_index = array('l')
+        self.names = array('l')
+        self.classnames = array('l')
+        self.times = array('d')
+        self.time_texts = array('l')
+        self.statuses = array('b')
+        self.messages = array('l')
+        self.system_outs = array('l')
+        self.system_errs = array('l')
+        # outputs written to spill files by the parser
+        self.spilled = 0
+        self._open_suites = []
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_events(cls, events):
+        """Build from (event, record) tuples as produced by XunitStream"""
+        results = cls()
+        for event, record in events:
+            if event == 'testsuite':
+                results.add_testsuite(record)
+            elif event == 'testcase':
+                results.add_testcase(record)
+            else:
+                results.end_testsuite()
+
+        return results
+
+    def add_testsuite(self, suite):
+        """Open a testsuite; following testcases belong to it"""
+        self._open_suites.append(len(self.suites))
+        self.order.append(len(self.suites) * 4 + EVENT_TESTSUITE)
+        self.suites.append(suite)
+
+    def end_testsuite(self):
+        """Close the current testsuite"""
+        suite = self._open_suites.pop()
+        self.order.append(suite * 4 + EVENT_TESTSUITE_END)
+
+    def add_testcase(self, testcase):
+        """Append a TestCaseRecord to the columns"""
+        strings = self.strings
+        self.order.append(len(self.names) * 4 + EVENT_TESTCASE)
+        self.suite_index.append(self._open_suites[-1]
+                                if self._open_suites else -1)
+        self.names.append(strings.add(testcase.name))
+        self.classnames.append(strings.add(testcase.classname, intern=True))
+        self.times.append(testcase.time if testcase.time is not None
+                          else math.nan)
+        self.time_texts.append(strings.add(testcase.time_text, intern=True))
+        self.statuses.append(STATUSES.index(testcase.status))
+        self.messages.append(strings.add(testcase.message))
+        self.system_outs.append(strings.add(testcase.system_out))
+        self.system_errs.append(strings.add(testcase.system_err))
+        self.spilled += sum(isinstance(output, SpilledOutput) for output
+                            in (testcase.system_out, testcase.system_err))
+
+    def testcase(self, index):
+        """Get a TestCaseRecord for the testcase at index"""
+        strings = self.strings
+        tc_time = self.times[index]
+
+        return TestCaseRecord(strings.get(self.names[index]),
+                              classname=strings.get(self.classnames[index]),
+                              time=None if math.isnan(tc_time) else tc_time,
+                              status=STATUSES[self.statuses[index]],
+                              message=strings.get(self.messages[index]),
+                              system_out=strings.get(self.system_outs[index]),
+                              system_err=strings.get(self.system_errs[index]),
+                              time_text=strings.get(self.time_texts[index]))
+
+    def events(self):
+        """Replay the results as (event, record) tuples"""
+        for entry in self.order:
+            index, kind = divmod(entry, 4)
+            if kind == EVENT_TESTCASE:
+                yield 'testcase', self.testcase(index)
+            elif kind == EVENT_TESTSUITE:
+                yield 'testsuite', self.suites[index]
+            else:
+                yield 'testsuite_end', None
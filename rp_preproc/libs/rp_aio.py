@@ -0,0 +1,242 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""asyncio uploader engine for the asynchronous ReportPortal API"""
+import asyncio
+from concurrent.futures import wait
+import threading
+import time
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.controller import RETRY_STATUSES, retry_statuses
+from rp_preproc.libs.rp_async import open_files
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+class AioEngine:
+    """Send the import requests as coroutines on one event loop.
+
+    A drop-in for AsyncDispatcher: the same submit() and wait_launch()
+    calls, but instead of a thread per concurrent request, all requests
+    run on an event loop in a single background thread, with at most
+    max_in_flight of them on the wire at a time. Retries and the adaptive
+    limit come from the RequestController shared with the sync session.
+    Needs aiohttp (pip install rp_preproc[asyncio]).
+    """
+    def __init__(self, token, controller,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, keep_alive=True):
+        if aiohttp is None:
+            raise ImportError('The asyncio engine needs aiohttp '
+                              '(pip install rp_preproc[asyncio])')
+
+        self.requests = 0
+        self.controller = controller
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+        self._token = token
+        self._keep_alive = keep_alive
+        # UUID -> future of the request that created it
+        self._created = {}
+        # launch UUID -> futures of all its requests
+        self._launches = {}
+        # parent UUID -> futures of the requests under it
+        self._children = {}
+        self._errors = []
+        self._lock = threading.Lock()
+        self._session = None
+        self._semaphore = None
+
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever,
+                                  name='rp_aio')
+        thread.daemon = True
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, ssl=False,
+                                         force_close=not self._keep_alive)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'Authorization': 'bearer {0}'.format(self._token)})
+
+    def submit(self, launch_ids, method, url, depends=(), creates=None,
+               json=None, files=None, parents=(), closes=None):
+        """Send a request once the requests creating depends are done
+
+        Args:
+            launch_ids (list): launches the request belongs to
+            depends (list): UUIDs the request refers to
+            creates (str): UUID created by the request
+            json (obj): JSON body
+            files (list): multipart body, contents may be pathlib.Path
+            parents (list): UUIDs the request is under
+            closes (str): UUID finished by the request, sent once all
+                requests under it are done
+        """
+        # pylint: disable=redefined-outer-name,too-many-arguments
+        with self._lock:
+            waits = [self._created[dep] for dep in depends
+                     if dep in self._created]
+            if closes is not None:
+                waits.extend(self._children.pop(closes, []))
+            future = asyncio.run_coroutine_threadsafe(
+                self._run(waits, method, url, json, files), self.loop)
+            if creates is not None:
+                self._created[creates] = future
+            for parent in parents:
+                self._children.setdefault(parent, []).append(future)
+            for launch_id in launch_ids:
+                self._launches.setdefault(launch_id, []).append(future)
+            self.requests += 1
+
+        return future
+
+    async def _run(self, waits, method, url, json_data, files):
+        if waits:
+            await asyncio.wait([asyncio.wrap_future(future)
+                                for future in waits])
+        if self._errors:
+            # no point sending children of items that failed
+            return None
+        try:
+            return await self.request(method, url, json=json_data,
+                                      files=files)
+        except Exception as err:  # pylint: disable=broad-except
+            g.log.error('Async request failed: %s', err)
+            self._errors.append(err)
+            raise
+
+    async def request(self, method, url, json=None, files=None):
+        """Send a request and return the response text
+
+        Retryable failures are retried as the controller says (a POST only
+        when the server can not have acted on it), then
+        aiohttp.ClientResponseError is raised on an error response.
+        """
+        # pylint: disable=redefined-outer-name
+        statuses = retry_statuses(method)
+        idempotent = statuses is RETRY_STATUSES
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self.controller.acquire_async()
+                try:
+                    lease_id = await self._lease()
+                except BaseException:
+                    self.controller.abandon()
+                    raise
+                start = time.time()
+                try:
+                    status, retry_after, text = await self._send(
+                        method, url, json, files)
+                except (aiohttp.ClientConnectionError,
+                        asyncio.TimeoutError) as err:
+                    self.controller.release(time.time() - start)
+                    # only a failed connect is sure to have sent nothing
+                    if not idempotent and \
+                            not isinstance(err, aiohttp.ClientConnectorError):
+                        raise
+                    delay = self.controller.retry_delay(attempt)
+                    if delay is None:
+                        raise
+                else:
+                    self.controller.release(time.time() - start, status)
+                    delay = None
+                    if status in statuses:
+                        delay = self.controller.retry_delay(attempt,
+                                                            retry_after)
+                    if delay is None:
+                        if status >= 400:
+                            g.log.error('%s %s: %s', method, url, text)
+                            raise aiohttp.ClientResponseError(
+                                None, (), status=status, message=text)
+                        return text
+                finally:
+                    if lease_id is not None:
+                        await self.loop.run_in_executor(
+                            None, self.controller.limiter.release, lease_id)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _lease(self):
+        """Wait for the shared rate limit, if there is one
+
+        The limiter is SQLite and may block on its lock, so it runs in the
+        default executor rather than on the loop.
+        """
+        limiter = self.controller.limiter
+        if limiter is None:
+            return None
+        while True:
+            lease_id, delay = await self.loop.run_in_executor(
+                None, limiter.try_acquire)
+            if lease_id is not None:
+                return lease_id
+            await asyncio.sleep(delay)
+
+    async def _send(self, method, url, json, files):
+        # pylint: disable=redefined-outer-name
+        self.in_flight += 1
+        self.max_seen_in_flight = max(self.max_seen_in_flight,
+                                      self.in_flight)
+        try:
+            with open_files(files) as opened:
+                data = None
+                if opened is not None:
+                    data = aiohttp.FormData()
+                    for field, (filename, content, mime) in opened:
+                        data.add_field(field, content, filename=filename,
+                                       content_type=mime)
+                async with self._session.request(method, url, json=json,
+                                                 data=data) as response:
+                    return (response.status,
+                            response.headers.get('Retry-After'),
+                            await response.text())
+        finally:
+            self.in_flight -= 1
+
+    def wait_launch(self, launch_id):
+        """Wait until every request sent for a launch is done"""
+        with self._lock:
+            futures = self._launches.pop(launch_id, [])
+        wait(futures)
+
+        done = set(futures)
+        with self._lock:
+            self._created = {created: future for created, future
+                             in self._created.items() if future not in done}
+            self._children = {
+                parent: [future for future in children if future not in done]
+                for parent, children in self._children.items()
+                if not done.issuperset(children)}
+
+        if self._errors:
+            raise self._errors[0]
+
+    def close(self):
+        """Close the session and stop the event loop"""
+        asyncio.run_coroutine_threadsafe(self._session.close(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,267 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""ReportPortal asynchronous (v2) API reporting with client-side UUIDs"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, ExitStack
+import json
+import pathlib
+import posixpath
+import threading
+import uuid
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.attachments import MultipartStream
+
+
+DEFAULT_ASYNC_WORKERS = 8
+
+
+@contextmanager
+def open_files(files):
+    """Open the pathlib.Path contents of a multipart files list
+
+    Attachments are queued as paths and only opened while being sent.
+    """
+    if files is None:
+        yield None
+        return
+
+    with ExitStack() as stack:
+        opened = []
+        for field, (filename, content, mime) in files:
+            if isinstance(content, pathlib.Path):
+                content = stack.enter_context(content.open('rb'))
+            opened.append((field, (filename, content, mime)))
+        yield opened
+
+
+class AsyncDispatcher:
+    """Send API requests in the background, in order of dependency.
+
+    Every request can name the UUIDs it depends on (the parent item for a
+    start, the item itself for a finish or log). A request only goes out
+    once the requests that created those UUIDs got their response. A
+    request can also be under parents (the item a start, log or finish is
+    reported in); the request closing a parent waits for all of them, so
+    an item is never finished while something under it is in flight. Work
+    is picked up in submission order and dependencies are always
+    submitted first, so a worker waiting on one can not deadlock the pool.
+    """
+    def __init__(self, session, max_workers=DEFAULT_ASYNC_WORKERS):
+        self.session = session
+        self.requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='rp_async')
+        # UUID -> future of the request that created it
+        self._created = {}
+        # launch UUID -> futures of all its requests
+        self._launches = {}
+        # parent UUID -> futures of the requests under it
+        self._children = {}
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def submit(self, launch_ids, method, url, depends=(), creates=None,
+               json=None, files=None, parents=(), closes=None):
+        """Send a request once the requests creating depends are done
+
+        Args:
+            launch_ids (list): launches the request belongs to
+            depends (list): UUIDs the request refers to
+            creates (str): UUID created by the request
+            json (obj): JSON body
+            files (list): multipart body, contents may be pathlib.Path
+            parents (list): UUIDs the request is under
+            closes (str): UUID finished by the request, sent once all
+                requests under it are done
+        """
+        # pylint: disable=redefined-outer-name,too-many-arguments
+        with self._lock:
+            waits = [self._created[dep] for dep in depends
+                     if dep in self._created]
+            if closes is not None:
+                waits.extend(self._children.pop(closes, []))
+            future = self._executor.submit(self._run, waits, method, url,
+                                           json, files)
+            if creates is not None:
+                self._created[creates] = future
+            for parent in parents:
+                self._children.setdefault(parent, []).append(future)
+            for launch_id in launch_ids:
+                self._launches.setdefault(launch_id, []).append(future)
+            self.requests += 1
+
+        return future
+
+    def _run(self, waits, method, url, json_data, files):
+        wait(waits)
+        if self._errors:
+            # no point sending children of items that failed
+            return None
+        try:
+            if files is None:
+                return self.request(method, url, json=json_data)
+            body = MultipartStream(files)
+            try:
+                return self.request(
+                    method, url, data=body,
+                    headers={'Content-Type': body.content_type})
+            finally:
+                body.close()
+        except Exception as err:  # pylint: disable=broad-except
+            g.log.error('Async request failed: %s', err)
+            self._errors.append(err)
+            raise
+
+    def request(self, method, url, **kwargs):
+        """Send a request and raise on an error response"""
+        response = self.session.request(method, url, verify=False, **kwargs)
+        response.raise_for_status()
+
+        return response
+
+    def wait_launch(self, launch_id):
+        """Wait until every request sent for a launch is done"""
+        with self._lock:
+            futures = self._launches.pop(launch_id, [])
+        wait(futures)
+
+        done = set(futures)
+        with self._lock:
+            self._created = {created: future for created, future
+                             in self._created.items() if future not in done}
+            self._children = {
+                parent: [future for future in children if future not in done]
+                for parent, children in self._children.items()
+                if not done.issuperset(children)}
+
+        if self._errors:
+            raise self._errors[0]
+
+    def close(self):
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=True)
+
+
+class AsyncReportPortalService:
+    """Drop-in for ReportPortalService on the asynchronous (v2) API.
+
+    UUIDs for the launch and items are generated here and returned at
+    once, so suites, steps, logs and finishes are queued without waiting
+    for the server. The launch finish waits for everything queued for it.
+    """
+    def __init__(self, endpoint, project, dispatcher):
+        self.endpoint = endpoint
+        self.project = project
+        self.dispatcher = dispatcher
+        self.base_url = posixpath.join(endpoint, 'api/v2', project)
+        self.stack = [None]
+        self.launch_id = None
+        # description/tags sent with the launch finish
+        self.launch_update = {}
+        # future of the request queued last
+        self.last_request = None
+
+    def _url(self, *path):
+        return posixpath.join(self.base_url, *path)
+
+    def _submit(self, method, path, data, depends=(), creates=None,
+                parent=None, closes=None):
+        # pylint: disable=too-many-arguments
+        self.last_request = self.dispatcher.submit(
+            [self.launch_id], method, self._url(*path), depends=depends,
+            creates=creates, json=data, parents=[parent or self.launch_id],
+            closes=closes)
+
+        return self.last_request
+
+    def start_launch(self, name, start_time, description=None, tags=None,
+                     mode=None):
+        """Start a launch"""
+        self.launch_id = uuid.uuid4().hex
+        data = {'uuid': self.launch_id, 'name': name,
+                'description': description, 'tags': tags,
+                'startTime': start_time, 'mode': mode}
+        self._submit('POST', ['launch'], data, creates=self.launch_id)
+        self.stack.append(None)
+        self.launch_update = {}
+
+        return self.launch_id
+
+    def update_launch(self, description=None, tags=None):
+        """Update the description and/or tags of the launch when it is
+        finished (the v1 update can not be ordered after the v2 start)"""
+        if description is not None:
+            self.launch_update['description'] = description
+        if tags is not None:
+            self.launch_update['tags'] = tags
+
+    def finish_launch(self, end_time, status=None):
+        """Finish the launch once all its requests are done"""
+        self.dispatcher.wait_launch(self.launch_id)
+        data = dict(self.launch_update, endTime=end_time, status=status)
+        self._submit('PUT', ['launch', self.launch_id, 'finish'], data)
+        self.dispatcher.wait_launch(self.launch_id)
+        g.log.debug('Async launch %s finished', self.launch_id)
+
+    def start_test_item(self, name, start_time, item_type, description=None,
+                        tags=None, parameters=None):
+        """Start a test item under the current one"""
+        if parameters is not None:
+            parameters = [{'key': key, 'value': str(value)}
+                          for key, value in parameters.items()]
+        item_id = uuid.uuid4().hex
+        parent_id = self.stack[-1]
+        data = {'uuid': item_id, 'name': name, 'description': description,
+                'tags': tags, 'startTime': start_time,
+                'launchUuid': self.launch_id, 'type': item_type,
+                'parameters': parameters}
+        path = ['item'] if parent_id is None else ['item', parent_id]
+        self._submit('POST', path, data,
+                     depends=[parent_id or self.launch_id], creates=item_id,
+                     parent=parent_id)
+        self.stack.append(item_id)
+
+        return item_id
+
+    def finish_test_item(self, end_time, status, issue=None):
+        """Finish the current test item"""
+        if issue is not None:
+            issue = {'issueType': issue.get('issue_type')}
+        item_id = self.stack.pop()
+        data = {'endTime': end_time, 'status': status, 'issue': issue,
+                'launchUuid': self.launch_id}
+        self._submit('PUT', ['item', item_id], data, depends=[item_id],
+                     parent=self.stack[-1], closes=item_id)
+
+    def log(self, time, message, level=None, attachment=None):
+        """Log a message (and attachment) for the current item"""
+        item_id = self.stack[-1] or self.launch_id
+        data = {'launchUuid': self.launch_id, 'itemUuid': item_id,
+                'time': time, 'message': message, 'level': level}
+        if attachment:
+            data['file'] = {'name': attachment['name']}
+            files = [('json_request_part',
+                      (None, json.dumps([data]), 'application/json')),
+                     ('file', (attachment['name'], attachment['data'],
+                               attachment.get('mime') or
+                               'application/octet-stream'))]
+            self.last_request = self.dispatcher.submit(
+                [self.launch_id], 'POST', self._url('log'),
+                depends=[item_id], files=files, parents=[item_id])
+        else:
+            self._submit('POST', ['log'], data, depends=[item_id],
+                         parent=item_id)
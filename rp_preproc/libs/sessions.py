@@ -0,0 +1,159 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Connection-pooled HTTP sessions shared by all ReportPortal calls"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.controller import RequestController
+from rp_preproc.libs.ratelimit import SharedRateLimiter
+
+
+DEFAULT_POOL_SIZE = 10
+
+
+def _rewind(files, data=None):
+    """Seek multipart file objects (or a streamed body) back to the start
+    for a retry"""
+    if hasattr(data, 'seek'):
+        data.seek(0)
+    if isinstance(files, dict):
+        files = files.items()
+    for _, content in files or ():
+        if isinstance(content, (tuple, list)):
+            content = content[1]
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+
+def _unsent(err):
+    """Did a call fail before its request went out (connecting)?"""
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(err, requests.exceptions.ConnectionError) and err.args:
+        # requests wraps urllib3's MaxRetryError, whose reason is the cause
+        reason = getattr(err.args[0], 'reason', err.args[0])
+        return isinstance(reason, (urllib3.exceptions.NewConnectionError,
+                                   urllib3.exceptions.ConnectTimeoutError))
+
+    return False
+
+
+class ControlledSession(requests.Session):
+    """Session sending every request through a RequestController"""
+    def __init__(self, controller):
+        super().__init__()
+        self.controller = controller
+
+    def request(self, method, url, *args, **kwargs):
+        # pylint: disable=arguments-differ
+        files = kwargs.get('files')
+        data = kwargs.get('data')
+
+        def send():
+            _rewind(files, data)
+            return super(ControlledSession, self).request(method, url,
+                                                          *args, **kwargs)
+
+        return self.controller.call(send, method=method, unsent=_unsent)
+
+
+class SessionRegistry:
+    """One pooled requests.Session per (endpoint, project, token).
+
+    Sessions live for the life of the process, so the API helpers, the
+    ReportPortalService instances of every import and every request
+    handled by the Flask service reuse the same open connections instead
+    of paying a new TCP/TLS handshake per call. They also share one
+    RequestController, so retries and the in-flight limit cover every
+    call made to the server.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._rate_limit = None
+
+    def set_rate_limit(self, path, rate=None, max_concurrent=None):
+        """Put new sessions under a rate limit shared with other processes
+
+        Args:
+            path (str): SQLite file shared by the processes
+            rate (float): requests per second per endpoint and project
+            max_concurrent (int): requests in flight per endpoint and project
+        """
+        if not rate and not max_concurrent:
+            self._rate_limit = None
+            return
+        self._rate_limit = {'path': path, 'rate': rate,
+                            'max_concurrent': max_concurrent}
+
+    def get(self, endpoint, project, token, pool_size=DEFAULT_POOL_SIZE,
+            keep_alive=True, controller=None):
+        """Get (or create) the session for an endpoint, project and token
+
+        Args:
+            pool_size (int): connections kept open per host
+            keep_alive (bool): keep connections open between calls
+            controller (dict): RequestController settings
+        """
+        key = (endpoint, project, token)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create(token, pool_size, keep_alive,
+                                       controller)
+                if self._rate_limit is not None:
+                    session.controller.limiter = SharedRateLimiter(
+                        key='{}/{}'.format(endpoint, project),
+                        **self._rate_limit)
+                self._sessions[key] = session
+                g.log.debug('SessionRegistry: new session for %s/%s '
+                            '(pool_size %s, keep_alive %s)', endpoint,
+                            project, pool_size, keep_alive)
+
+        return session
+
+    @staticmethod
+    def _create(token, pool_size, keep_alive, controller):
+        session = ControlledSession(RequestController(**(controller or {})))
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Authorization'] = 'bearer {0}'.format(token)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        session.verify = False
+
+        return session
+
+    def close(self):
+        """Close all sessions"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+# process wide registry
+SESSIONS = SessionRegistry()
@@ -0,0 +1,156 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Record ReportPortal operations to a spool for replaying later"""
+import gzip
+import json
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+
+from glusto.core import Glusto as g
+
+
+SPOOL_OPS = 'ops.ndjson'
+SPOOL_ATTACHMENTS = 'attachments'
+SPOOL_REPLAYED = 'replayed'
+
+
+class SpoolWriter:
+    """Append-only NDJSON operation log of one launch.
+
+    Operations are written in the order they are made, one compact JSON
+    object per line (gzipped if compress), to <spool_dir>/<launch>/ with
+    the attachments copied next to them. The file is renamed to its final
+    name when the launch finishes, so replay never picks up a launch that
+    is still being written.
+    """
+    def __init__(self, spool_dir, launch_id, compress=False):
+        self.path = os.path.join(spool_dir, launch_id)
+        os.makedirs(os.path.join(self.path, SPOOL_ATTACHMENTS))
+        self.filename = os.path.join(
+            self.path, SPOOL_OPS + ('.gz' if compress else ''))
+        opener = gzip.open if compress else open
+        self._fd = opener(self.filename + '.part', 'wt')
+        self._lock = threading.Lock()
+        self.ops = 0
+
+    def write(self, operation):
+        """Append an operation"""
+        line = json.dumps(operation, separators=(',', ':'))
+        with self._lock:
+            self._fd.write(line)
+            self._fd.write('\n')
+            self.ops += 1
+
+    def add_attachment(self, name, data):
+        """Store attachment data (bytes or a pathlib.Path to copy) and
+        return its path inside the spool"""
+        relpath = os.path.join(SPOOL_ATTACHMENTS, uuid.uuid4().hex,
+                               os.path.basename(name))
+        os.mkdir(os.path.dirname(os.path.join(self.path, relpath)))
+        if isinstance(data, pathlib.Path):
+            shutil.copyfile(str(data), os.path.join(self.path, relpath))
+            return relpath
+        with open(os.path.join(self.path, relpath), 'wb') as attachfd:
+            attachfd.write(data)
+
+        return relpath
+
+    def close(self):
+        """Finish the spool of the launch"""
+        with self._lock:
+            self._fd.close()
+            os.replace(self.filename + '.part', self.filename)
+        g.log.info('Spooled %s operations to %s', self.ops, self.filename)
+
+
+class SpoolService:
+    """Drop-in for ReportPortalService writing operations to a spool.
+
+    UUIDs are generated here, like in the async API mode, and every call
+    returns at once without contacting ReportPortal. Forked services
+    positioned in the same launch write to the same SpoolWriter.
+    """
+    # launch UUID -> SpoolWriter, for all instances
+    _writers = {}
+
+    def __init__(self, spool_dir, compress=False):
+        self.spool_dir = spool_dir
+        self.compress = compress
+        self.stack = [None]
+        self.launch_id = None
+
+    @property
+    def writer(self):
+        """SpoolWriter of the current launch"""
+        return self._writers[self.launch_id]
+
+    def start_launch(self, name, start_time, description=None, tags=None,
+                     mode=None):
+        """Start spooling a launch"""
+        self.launch_id = uuid.uuid4().hex
+        self._writers[self.launch_id] = SpoolWriter(
+            self.spool_dir, self.launch_id, compress=self.compress)
+        self.writer.write({'op': 'start_launch', 'uuid': self.launch_id,
+                           'name': name, 'start_time': start_time,
+                           'description': description, 'tags': tags,
+                           'mode': mode})
+        self.stack.append(None)
+
+        return self.launch_id
+
+    def update_launch(self, description=None, tags=None):
+        """Update the description and/or tags of the launch"""
+        self.writer.write({'op': 'update_launch', 'uuid': self.launch_id,
+                           'description': description, 'tags': tags})
+
+    def finish_launch(self, end_time, status=None):
+        """Finish the launch and close its spool"""
+        self.writer.write({'op': 'finish_launch', 'uuid': self.launch_id,
+                           'end_time': end_time, 'status': status})
+        self._writers.pop(self.launch_id).close()
+
+    def start_test_item(self, name, start_time, item_type, description=None,
+                        tags=None, parameters=None):
+        """Start a test item under the current one"""
+        item_id = uuid.uuid4().hex
+        self.writer.write({'op': 'start_item', 'uuid': item_id,
+                           'parent': self.stack[-1],
+                           'launch': self.launch_id, 'name': name,
+                           'start_time': start_time, 'type': item_type,
+                           'description': description, 'tags': tags,
+                           'parameters': parameters})
+        self.stack.append(item_id)
+
+        return item_id
+
+    def finish_test_item(self, end_time, status, issue=None):
+        """Finish the current test item"""
+        self.writer.write({'op': 'finish_item', 'uuid': self.stack.pop(),
+                           'end_time': end_time, 'status': status,
+                           'issue': issue})
+
+    def log(self, time, message, level=None, attachment=None):
+        """Log a message (and attachment) for the current item"""
+        operation = {'op': 'log', 'item': self.stack[-1],
+                     'launch': self.launch_id, 'time': time,
+                     'message': message, 'level': level}
+        if attachment:
+            operation['file'] = self.writer.add_attachment(
+                attachment['name'], attachment['data'])
+        self.writer.write(operation)
@@ -0,0 +1,275 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Incremental xUnit XML parser for streaming large result files"""
+import gzip
+import os
+import tempfile
+from xml.parsers import expat
+
+from glusto.core import Glusto as g
+from rp_preproc.libs.results import SpilledOutput, SuiteRecord, \
+    TestCaseRecord
+
+
+# testcase elements whose text can be spilled to a file
+OUTPUT_ELEMENTS = ('system-out', 'system-err')
+# characters of spilled text kept for the head and the tail of an excerpt
+EXCERPT_SIZE = 2048
+
+
+class XunitStream:
+    """Incremental (SAX-style) xUnit XML parser.
+
+    Testsuite boundaries and completed testcases are handed out as soon as
+    they are parsed and nothing is kept after that, so memory use does not
+    grow with the size of the file. Each testcase is collected in the same
+    dict form xmltodict.parse() would give it and then reduced to a
+    TestCaseRecord.
+
+    With a spill_dir, the text of a system-out or system-err growing past
+    spill_size characters is written on to a gzip file there as it is
+    parsed, and the record gets a SpilledOutput instead of the string.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, xmlfd, chunk_size=65536, spill_dir=None,
+                 spill_size=None):
+        """Create a streaming parser
+
+        Args:
+            xmlfd (obj): file object opened in binary mode
+            chunk_size (int): bytes to read from the file per parse step
+            spill_dir (str): directory to spill large outputs to
+            spill_size (int): characters of output kept in memory
+        """
+        self.xmlfd = xmlfd
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir
+        self.spill_size = spill_size if spill_dir else None
+        self._events = []
+        # element stack [name, dict, text chunks] inside the current testcase
+        self._nodes = []
+        # characters in the text chunks of the current output element
+        self._text_size = 0
+        # [gzip file, SpilledOutput] of the output being spilled
+        self._spill = None
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+        self._parser.CharacterDataHandler = self._character_data
+
+    def __iter__(self):
+        return self.events()
+
+    def events(self):
+        """Parse the file and yield events as they complete
+
+        Yields:
+            ('testsuite', SuiteRecord) when a testsuite opens
+            ('testcase', TestCaseRecord) when a testcase closes
+            ('testsuite_end', None) when a testsuite closes
+        """
+        while True:
+            chunk = self.xmlfd.read(self.chunk_size)
+            self._parser.Parse(chunk, not chunk)
+            events = self._events
+            self._events = []
+            yield from events
+
+            if not chunk:
+                break
+
+        g.log.debug('XunitStream: finished parsing %s',
+                    getattr(self.xmlfd, 'name', self.xmlfd))
+
+    @staticmethod
+    def _add_child(parent, name, value):
+        """Add a child value to a node the way xmltodict does"""
+        if name in parent:
+            if isinstance(parent[name], list):
+                parent[name].append(value)
+            else:
+                parent[name] = [parent[name], value]
+        else:
+            parent[name] = value
+
+    def _start_element(self, name, attrs):
+        attributes = {'@{}'.format(key): value for key, value in attrs.items()}
+        if self._nodes or name == 'testcase':
+            self._nodes.append([name, attributes, []])
+            self._text_size = 0
+        elif name == 'testsuite':
+            self._events.append(('testsuite',
+                                 SuiteRecord.from_dict(attributes)))
+
+    def _end_element(self, name):
+        if self._spill is not None:
+            node_name, _, _ = self._nodes.pop()
+            if len(self._nodes) == 1:
+                # the output element itself (its children only add text)
+                self._add_child(self._nodes[-1][1], node_name,
+                                self._end_spill())
+        elif self._nodes:
+            node_name, node, chunks = self._nodes.pop()
+            text = ''.join(chunks).strip()
+            if text:
+                node['#text'] = text
+
+            if self._nodes:
+                if len(node) == 1 and text:
+                    # text-only elements collapse to a string in xmltodict
+                    node = text
+                self._add_child(self._nodes[-1][1], node_name, node or None)
+            else:
+                self._events.append(('testcase',
+                                     TestCaseRecord.from_dict(node)))
+        elif name == 'testsuite':
+            self._events.append(('testsuite_end', None))
+
+    def _character_data(self, data):
+        if self._spill is not None:
+            self._write_spill(data)
+        elif self._nodes:
+            chunks = self._nodes[-1][2]
+            chunks.append(data)
+            self._text_size += len(data)
+            if self.spill_size is not None and \
+                    self._text_size > self.spill_size and \
+                    len(self._nodes) == 2 and \
+                    self._nodes[-1][0] in OUTPUT_ELEMENTS:
+                self._start_spill()
+
+    def _start_spill(self):
+        """Move the text of the current output element to a gzip file"""
+        name, _, chunks = self._nodes[-1]
+        text = ''.join(chunks).lstrip()
+        chunks.clear()
+        path = os.path.join(tempfile.mkdtemp(dir=self.spill_dir),
+                            '{}.txt.gz'.format(name))
+        self._spill = [gzip.open(path, 'wt', encoding='utf8'),
+                       SpilledOutput(name, path, 0, text[:EXCERPT_SIZE], '')]
+        self._write_spill(text)
+
+    def _write_spill(self, data):
+        spillfd, output = self._spill
+        spillfd.write(data)
+        output.size += len(data)
+        output.tail = (output.tail + data)[-EXCERPT_SIZE:]
+
+    def _end_spill(self):
+        spillfd, output = self._spill
+        self._spill = None
+        spillfd.close()
+        output.tail = output.tail.rstrip()
+        g.log.debug('XunitStream: spilled %s characters of %s to %s',
+                    output.size, output.name, output.path)
+
+        return output
+
+
+class XunitPreflight:
+    """Fast scan of a result file before anything is sent to ReportPortal.
+
+    Only element starts and ends are handled (no text, no tree), which
+    checks the file is well-formed and counts what the import will do
+    at a fraction of the cost of parsing it for import.
+    """
+    def __init__(self, xmlfd, count_attachments=None, log_batch_size=1):
+        """Create a preflight scanner
+
+        Args:
+            xmlfd (obj): file object opened in binary mode
+            count_attachments (func): called with (classname, name) of
+                each failed testcase, returns its number of attachments
+            log_batch_size (int): log entries the import sends per call
+        """
+        self.xmlfd = xmlfd
+        self.count_attachments = count_attachments
+        self.log_batch_size = max(1, log_batch_size)
+        self.counts = {'testsuites': 0, 'testcases': 0, 'failures': 0,
+                       'skipped': 0, 'system_out': 0, 'system_err': 0,
+                       'attachments': 0}
+        self._testcase = None
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+
+    @property
+    def api_calls(self):
+        """Estimated number of ReportPortal API calls for the import
+
+        Batches cut short by the byte limit add a few calls to this.
+        """
+        counts = self.counts
+        # one log entry per message and attachment, sent in full batches
+        logs = (counts['failures'] + counts['skipped'] +
+                counts['system_out'] + counts['system_err'] +
+                counts['attachments'])
+        # launch start/finish and item start/finish
+        return (2 + 2 * counts['testsuites'] + 2 * counts['testcases'] +
+                (logs + self.log_batch_size - 1) // self.log_batch_size)
+
+    def scan(self):
+        """Scan the file
+
+        Returns:
+            dict with valid, error, the counts and api_calls
+        """
+        report = {'valid': True, 'error': None}
+        try:
+            self._parser.ParseFile(self.xmlfd)
+        except expat.ExpatError as err:
+            report['valid'] = False
+            report['error'] = str(err)
+        report.update(self.counts)
+        report['api_calls'] = self.api_calls
+
+        return report
+
+    def _start_element(self, name, attrs):
+        if name == 'testcase':
+            self._testcase = {'classname': attrs.get('classname', ''),
+                              'name': attrs.get('name', attrs.get('id')),
+                              'status': 'PASSED'}
+            self.counts['testcases'] += 1
+        elif self._testcase is not None:
+            if name in ('failure', 'error'):
+                self._testcase['status'] = 'FAILED'
+            elif name == 'skipped' and \
+                    self._testcase['status'] == 'PASSED':
+                self._testcase['status'] = 'SKIPPED'
+            elif name in ('system-out', 'system-err'):
+                self._testcase[name.replace('-', '_')] = True
+        elif name == 'testsuite':
+            self.counts['testsuites'] += 1
+
+    def _end_element(self, name):
+        if name != 'testcase' or self._testcase is None:
+            return
+
+        testcase = self._testcase
+        self._testcase = None
+        for output in ('system_out', 'system_err'):
+            if testcase.get(output):
+                self.counts[output] += 1
+        if testcase['status'] == 'SKIPPED':
+            self.counts['skipped'] += 1
+        elif testcase['status'] == 'FAILED':
+            self.counts['failures'] += 1
+            if self.count_attachments is not None:
+                self.counts['attachments'] += \
+                    self.count_attachments(testcase['classname'],
+                                           testcase['name'])
@@ -14,83 +14,523 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 #
 """xUnit XML class to handle xunit translation into ReportPortal calls"""
+import bz2
+import fnmatch
+import gzip
+import lzma
 import os
+import shutil
+import tempfile
+import threading
 import time
 
 from glusto.core import Glusto as g
+from rp_preproc.libs.analytics import DurationStats, describe
+from rp_preproc.libs.journal import pending
+from rp_preproc.libs.pipeline import Pipeline, PipelineQueue
 from rp_preproc.libs.reportportal import Launch, RpLog
+from rp_preproc.libs.results import SpilledOutput, SuiteRecord, \
+    TestCaseRecord, TestResults
+from rp_preproc.libs.xunit_stream import XunitPreflight, XunitStream
 
 
+# result files are read through the matching decompressor, never unpacked
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+RESULT_EXTENSIONS = ('.xml', '.xml.gz', '.xml.bz2', '.xml.xz')
+RESULT_PATTERNS = ['*{}'.format(extension) for extension in RESULT_EXTENSIONS]
+
 class XunitXML:
     '''Class for processing the xUnit XML file for ReportPortal'''
-    def __init__(self, rportal, name=None, configs=None, xml_data=None):
+    def __init__(self, rportal, name=None, configs=None, fqpath=None,
+                 results=None, journal=None, launch_id=None,
+                 attachment_index=None, spill_dir=None):
+        """Create an importer for one result file
+
+        Args:
+            journal (obj): ImportJournal to checkpoint the import in
+            launch_id (str): report into this started launch, with the
+                file as a top-level suite (rportal positioned at it),
+                instead of a launch of its own
+            attachment_index (obj): AttachmentIndex of the payload
+            spill_dir (str): directory the streaming parser spills large
+                system-out/system-err to (kept until the launch finishes)
+        """
         self.rportal = rportal
         self.name = name
         self._configs = configs
-        self.xml_data = xml_data
+        self.fqpath = fqpath
+        self.results = results
+        self.journal = journal
+        self.launch_id = launch_id
+        self.attachment_index = attachment_index
+        self.spill_dir = spill_dir
+        self.file_suite = None
+        self.pipeline = None
+        self.durations = None
+        self.skipped = 0
+        self.tmp_dir = None
 
     @staticmethod
-    def get_file_list(results_dir):
-        """Get a list of XML results files from a directory"""
-        # get list of xml result files
-        result_file_list = []
-        if os.path.exists(results_dir):
-            for root, _, files in os.walk(results_dir):
-                for thefile in files:
-                    fqpath = os.path.join(root, thefile)
-                    if os.path.splitext(fqpath)[1] == '.xml':
-                        result_file_list.append(fqpath)
-                        g.log.debug('fqpath %s', fqpath)
+    def find_files(results_dir, include=None, exclude=None, max_depth=None):
+        """Find result files in a directory tree
+
+        Args:
+            results_dir (str): directory to search
+            include (list): glob patterns of file names to import
+                (default: RESULT_PATTERNS)
+            exclude (list): glob patterns matched against names and paths
+                relative to results_dir; matching directories are skipped
+                without being read
+            max_depth (int): levels of subdirectories to descend into
+                (default: no limit)
+
+        Returns:
+            list of (fqpath, size) tuples, largest file first
+        """
+        include = include or RESULT_PATTERNS
+        exclude = exclude or []
+        result_files = []
+        dirs = [(results_dir, '', 0)]
+        while dirs:
+            dirpath, relpath, depth = dirs.pop()
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    entry_relpath = os.path.join(relpath, entry.name)
+                    if any(fnmatch.fnmatch(entry.name, pattern) or
+                           fnmatch.fnmatch(entry_relpath, pattern)
+                           for pattern in exclude):
+                        continue
+
+                    if entry.is_dir(follow_symlinks=False):
+                        if max_depth is None or depth < max_depth:
+                            dirs.append((entry.path, entry_relpath,
+                                         depth + 1))
+                    elif (entry.is_file() and
+                          any(fnmatch.fnmatch(entry.name, pattern)
+                              for pattern in include)):
+                        result_files.append((entry.path,
+                                             entry.stat().st_size))
+                        g.log.debug('fqpath %s', entry.path)
+
+        # largest first so a big file never ends up running alone at the end
+        result_files.sort(key=lambda result_file: result_file[1],
+                          reverse=True)
 
-            return result_file_list
+        return result_files
+
+    @staticmethod
+    def get_file_list(results_dir, include=None, exclude=None,
+                      max_depth=None):
+        """Get a list of XML results files from a directory, largest first"""
+        if os.path.exists(results_dir):
+            return [fqpath for fqpath, _ in
+                    XunitXML.find_files(results_dir, include=include,
+                                        exclude=exclude,
+                                        max_depth=max_depth)]
 
         return False
 
+    @staticmethod
+    def is_compressed(fqpath):
+        """Is the result file compressed?"""
+        return os.path.splitext(fqpath)[1] in COMPRESSED_OPENERS
+
+    @staticmethod
+    def open_file(fqpath):
+        """Open a result file for binary reading, decompressing on the fly"""
+        opener = COMPRESSED_OPENERS.get(os.path.splitext(fqpath)[1], open)
+
+        return opener(fqpath, 'rb')
+
+    @staticmethod
+    def get_name(fqpath):
+        """Get the name of a result file without .xml and compression"""
+        filename = os.path.basename(fqpath)
+        if XunitXML.is_compressed(filename):
+            filename, _ = os.path.splitext(filename)
+        filename_base, _ = os.path.splitext(filename)
+
+        return filename_base
+
+    @staticmethod
+    def preflight(fqpath, attachments_dir=None, attachment_index=None,
+                  log_batch_size=1):
+        """Check a result file is usable and estimate the import size
+
+        Args:
+            fqpath (str): path of the result file
+            attachments_dir (str): payload attachments directory used to
+                count the attachments of failed testcases
+            attachment_index (obj): AttachmentIndex to count them with
+                instead
+            log_batch_size (int): log entries the import sends per call
+
+        Returns:
+            dict report from XunitPreflight.scan() plus the file path
+        """
+        xml_name = XunitXML.get_name(fqpath)
+        count_attachments = None
+        if attachment_index is not None:
+            def count_attachments(classname, name):
+                tc_attach_dir = '{}.{}'.format(classname, name)
+                return len(attachment_index.get(xml_name, tc_attach_dir,
+                                                 count_only=True))
+        elif attachments_dir is not None:
+            def count_attachments(classname, name):
+                tc_attach_dir = '{}.{}'.format(classname, name)
+                return len(RpLog.get_attachments(attachments_dir, xml_name,
+                                                 tc_attach_dir))
+
+        try:
+            with XunitXML.open_file(fqpath) as xmlfd:
+                report = XunitPreflight(xmlfd, count_attachments,
+                                        log_batch_size).scan()
+        except (EOFError, OSError, lzma.LZMAError) as err:
+            # unreadable or corrupt compressed file
+            report = {'valid': False, 'error': str(err)}
+        report['file'] = fqpath
+
+        return report
+
+    @property
+    def spill_size(self):
+        """Characters of system-out/system-err kept in memory before the
+        streaming parser spills them to a file"""
+        if self._configs is None:
+            return None
+
+        return self._configs.output_spill_size
+
+    @staticmethod
+    def parse(fqpath, cache=None, spill_dir=None, spill_size=None):
+        """Parse a result file into a compact TestResults object
+
+        Args:
+            fqpath (str): path of the result file
+            cache (obj): ResultsCache to look up and store the results in
+            spill_dir (str): directory to spill large outputs to
+            spill_size (int): characters of output kept in memory
+        """
+        if cache is not None:
+            cache_key = cache.get_key(fqpath)
+            results = cache.get(cache_key)
+            if results is not None:
+                return results
+
+        with XunitXML.open_file(fqpath) as xmlfd:
+            results = TestResults.from_events(
+                XunitStream(xmlfd, spill_dir=spill_dir,
+                            spill_size=spill_size))
+        g.log.debug('Parsed %s testcase(s) in %s testsuite(s) from %s',
+                    len(results), len(results.suites), fqpath)
+
+        # spill files do not outlive the import, so neither may the results
+        if cache is not None and not results.spilled:
+            cache.put(cache_key, results)
+
+        return results
+
+    @property
+    def shards(self):
+        """Number of workers reporting the testcases of one testsuite"""
+        if self._configs is None:
+            return 1
+
+        return self._configs.shards
+
+    @property
+    def compact_passed(self):
+        """Report the passed testcases of each testsuite as one item"""
+        if self._configs is None:
+            return False
+
+        return self._configs.compact_passed
+
+    def passed_summary(self, tsuite):
+        """Get a PassedSummary for a testsuite if compacting"""
+        if not self.compact_passed:
+            return None
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='rp_preproc_passed_')
+
+        return PassedSummary(self.rportal, self.name, tsuite.name,
+                             self.tmp_dir, configs=self._configs)
+
+    @property
+    def use_pipeline(self):
+        """Run parsing, transforming and uploading as separate stages"""
+        if self._configs is None:
+            return False
+
+        return self._configs.pipeline
+
+    def start_shards(self):
+        """Start shard workers for the current testsuite if configured"""
+        if self.shards > 1:
+            shards = TestCaseShards(self.rportal, self.name, self.shards,
+                                    configs=self._configs,
+                                    attachment_index=self.attachment_index)
+            if self.pipeline is not None:
+                self.pipeline.add_queue(shards.queue)
+
+            return shards
+
+        return None
+
+    def report_testcase(self, testcase, shards=None):
+        """Report a testcase directly or hand it to the shard workers"""
+        if shards is not None:
+            shards.add(testcase)
+        else:
+            if not isinstance(testcase, TestCase):
+                testcase = TestCase(self.rportal, self.name, testcase,
+                                    configs=self._configs,
+                                    attachment_index=self.attachment_index)
+            testcase.start()
+            testcase.finish()
+
+    def prepare_event(self, event, record):
+        """Pipeline transform stage: build the requests for a testcase"""
+        if event == 'testcase':
+            tcase = TestCase(self.rportal, self.name, record,
+                             configs=self._configs,
+                             attachment_index=self.attachment_index)
+            tcase.prepare()
+
+            return event, tcase
+
+        return event, record
+
+    def events(self):
+        """Generate (event, record) tuples from the source given"""
+        if self.results is not None:
+            yield from self.results.events()
+        else:
+            # parse and report one testcase at a time
+            g.log.debug('Streaming testsuite(s) from %s', self.fqpath)
+            with XunitXML.open_file(self.fqpath) as xmlfd:
+                yield from XunitStream(xmlfd, spill_dir=self.spill_dir,
+                                       spill_size=self.spill_size)
+
+    def file_suite_events(self, events):
+        """Wrap the events of the file in a testsuite named after it
+
+        The file suite fails if any of its testsuites does.
+        """
+        self.file_suite = SuiteRecord(self.name)
+        yield 'testsuite', self.file_suite
+        for event, record in events:
+            if event == 'testsuite':
+                self.file_suite.failures += record.failures
+                self.file_suite.errors += record.errors
+            yield event, record
+        yield 'testsuite_end', None
+
     def process(self):
         """Process xUnit XML data"""
         # override env var with config provided vars
         rp_host_url = os.environ.get('RP_HOST_URL', None)
         g.log.debug('rp_host_url: %s', rp_host_url)
 
-        # Start a launch
-        launch = Launch(self.rportal)
-        launch_id = launch.start()
-
-        # check for multiple testsuites in xUnit
-        if self.xml_data.get('testsuites'):
-            # get test suites list
-            testsuites_object = self.xml_data.get('testsuites')
-            testsuites = testsuites_object.get('testsuite') \
-                if isinstance(testsuites_object.get('testsuite'), list) \
-                else [testsuites_object.get('testsuite')]
+        durations_description = \
+            self._configs is not None and self._configs.durations_description
+
+        journal = self.journal
+        if journal is not None and journal.launch_finished:
+            g.log.info('%s was already imported into launch %s', self.name,
+                       journal.launch_id or self.launch_id)
+            if self.launch_id is None:
+                self.rportal.launches.add(journal.launch_id)
+            return {'launch_id': journal.launch_id or self.launch_id,
+                    'journal': {'resumed': True, 'complete': True}}, 200
+
+        launch = None
+        summary = None
+        if self.launch_id is None:
+            # Start a launch (or continue the one of an interrupted run)
+            launch = Launch(self.rportal)
+        if self.results is not None:
+            # the whole @time column is already at hand
+            summary = DurationStats.from_results(self.results)
+            if durations_description and launch is not None:
+                launch.append_description(describe(summary))
         else:
-            testsuites = [self.xml_data.get('testsuite')]
-
-        # create testsuite(s)
-        g.log.debug('Processing %s testsuite(s)', len(testsuites))
-        for testsuite in testsuites:
-            testcases = testsuite.get('testcase')
-            if not isinstance(testcases, list):
-                testcases = [testcases]
-            tsuite = TestSuite(self.rportal, self.name, testsuite)
-            tsuite.start()
-
-            # create all testcases
-            g.log.debug('Starting testcases')
-            for testcase in testcases:
-                tcase = TestCase(self.rportal, self.name, testcase,
-                                 configs=self._configs)
+            # collect the times while reporting
+            self.durations = DurationStats()
+        if launch is None:
+            launch_id = self.launch_id
+        elif journal is not None and journal.resuming:
+            launch_id = launch.resume(journal.launch_id)
+        else:
+            launch_id = launch.start()
+            if journal is not None:
+                journal.launch_started(
+                    launch_id, after=pending(self.rportal.service))
+
+        response = {'launch_id': launch_id}
+        events = self.events()
+        if launch is None:
+            events = self.file_suite_events(events)
+        if self.use_pipeline:
+            self.pipeline = Pipeline(queue_size=self._configs.queue_size)
+            events = self.pipeline.run(events, self.prepare_event)
+
+        try:
+            self.process_events(events)
+
+            if self.pipeline is not None:
+                response['pipeline'] = self.pipeline.stats
+                g.log.info('Pipeline queues for %s: %s', self.name,
+                           response['pipeline'])
+
+            if summary is None:
+                summary = self.durations.summary()
+                if durations_description and launch is not None:
+                    launch.update(description='{}\n\n{}'.format(
+                        launch.description, describe(summary)))
+            response['durations'] = summary
+
+            # Finish the launch (a shared one is finished by the caller,
+            # who also completes the journal once it is)
+            if launch is not None:
+                launch.finish()
+                if journal is not None:
+                    journal.launch_done()
+            if journal is not None:
+                response['journal'] = {'resumed': journal.resuming,
+                                       'skipped': self.skipped}
+        finally:
+            # the launch finish waited for the summary attachments (the
+            # caller removes them after finishing a shared launch)
+            if self.tmp_dir is not None and self.launch_id is None:
+                shutil.rmtree(self.tmp_dir, ignore_errors=True)
+                self.tmp_dir = None
+
+        return response, 200
+
+    def process_events(self, events):
+        """Report (event, record) tuples from a parser or TestResults"""
+        testsuites = []
+        # testsuites and testcases are journaled by their position
+        position = -1
+        for event, record in events:
+            if event == 'testsuite':
+                position += 1
+                tsuite = TestSuite(self.rportal, self.name, record)
+                if self.journal is not None:
+                    tsuite.track(self.journal, position)
+                tsuite.start()
+                g.log.debug('Starting testcases')
+                suite_index = -1
+                if self.durations is not None and \
+                        record is not self.file_suite:
+                    suite_index = self.durations.add_testsuite(tsuite.name)
+                passed = self.passed_summary(tsuite)
+                if passed is not None and self.journal is not None:
+                    passed.track(self.journal, '{}:passed'.format(position))
+                # the testcases are all in the testsuites of a file suite
+                shards = None if record is self.file_suite \
+                    else self.start_shards()
+                testsuites.append((tsuite, shards, suite_index, passed))
+            elif event == 'testcase':
+                position += 1
+                shards = testsuites[-1][1] if testsuites else None
+                testcase = record.testcase \
+                    if isinstance(record, TestCase) else record
+                if self.durations is not None:
+                    self.durations.add(
+                        testsuites[-1][2] if testsuites else -1,
+                        testcase.name, testcase.time)
+                if testsuites and testsuites[-1][3] is not None and \
+                        testcase.status == 'PASSED':
+                    testsuites[-1][3].add(testcase)
+                    continue
+                if self.journal is not None:
+                    if position in self.journal.logged:
+                        # reported completely by an interrupted run
+                        self.skipped += 1
+                        continue
+                    if not isinstance(record, TestCase):
+                        record = TestCase(
+                            self.rportal, self.name, record,
+                            configs=self._configs,
+                            attachment_index=self.attachment_index)
+                    record.track(self.journal, position)
+                self.report_testcase(record, shards)
+            elif testsuites:
+                tsuite, shards, _, passed = testsuites.pop()
+                if passed is not None and passed.count and \
+                        (self.journal is None or
+                         passed.position not in self.journal.logged):
+                    self.report_testcase(passed, shards)
+                elif passed is not None:
+                    passed.close()
+                if shards is not None:
+                    shards.finish()
+                g.log.debug('\nFinished testcases')
+                tsuite.finish()
+
+
+class TestCaseShards:
+    """Report the testcases of one testsuite from several workers at once.
+
+    Every shard has its own service forked at the started testsuite, so
+    its testcases land in the same launch and suite as serial reporting
+    would put them. The suite is finished only after finish() returns.
+    """
+    def __init__(self, rportal, xml_name, num_shards, configs=None,
+                 attachment_index=None):
+        self.xml_name = xml_name
+        self._configs = configs
+        self.attachment_index = attachment_index
+        self.queue = PipelineQueue('upload', num_shards * 64)
+        self._errors = []
+        self._threads = []
+        g.log.debug('Starting %s testcase shards', num_shards)
+        for _ in range(num_shards):
+            thread = threading.Thread(target=self._run,
+                                      args=(rportal.fork(),))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self, rportal):
+        """Shard worker loop"""
+        while True:
+            testcase = self.queue.get()
+            if testcase is None:
+                break
+            if self._errors:
+                # another shard failed, just drain the queue
+                continue
+
+            try:
+                if isinstance(testcase, TestCase):
+                    tcase = testcase
+                    tcase.bind(rportal)
+                else:
+                    tcase = TestCase(rportal, self.xml_name, testcase,
+                                     configs=self._configs,
+                                     attachment_index=self.attachment_index)
                 tcase.start()
                 tcase.finish()
+            except Exception as err:  # pylint: disable=broad-except
+                g.log.error('Testcase shard failed: %s', err)
+                self._errors.append(err)
 
-            g.log.debug('\nFinished testcases')
+    def add(self, testcase):
+        """Queue a testcase for the next free shard"""
+        self.queue.put(testcase)
 
-            tsuite.finish()
-
-        # Finish the launch
-        launch.finish()
+    def finish(self):
+        """Wait until all queued testcases have been reported"""
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
 
-        return {'launch_id': launch_id}, 200
+        if self._errors:
+            raise self._errors[0]
 
 
 class TestSuites:
@@ -102,100 +542,224 @@ class TestSuites:
 class TestSuite:
     """Class to handle TestSuite xUnit specific items"""
     def __init__(self, rportal, xml_name, testsuite):
+        if not isinstance(testsuite, SuiteRecord):
+            testsuite = SuiteRecord.from_dict(testsuite)
         self.service = rportal.service
         self.xml_name = xml_name
         self.testsuite = testsuite
-        self.name = testsuite.get('@name', testsuite.get('@id', 'NULL'))
+        self.name = testsuite.name
         self.item_type = 'SUITE'
-        self.num_failures = int(self.testsuite.get('@failures', '0'))
-        self.num_errors = int(self.testsuite.get('@errors', '0'))
-        if self.num_failures > 0 or self.num_errors > 0:
-            self.status = 'FAILED'
-        else:
-            self.status = 'PASSED'
+        self.num_failures = testsuite.failures
+        self.num_errors = testsuite.errors
+        self.status = testsuite.status
+        self.journal = None
+        self.position = None
+
+    def track(self, journal, position):
+        """Record progress in an ImportJournal (and skip what it has)"""
+        self.journal = journal
+        self.position = position
 
     def start(self):
         """Start a testsuite section in ReportPortal"""
+        item_id = None
+        if self.journal is not None:
+            item_id = self.journal.started.get(self.position)
+        if item_id is not None:
+            # started by an interrupted run
+            self.service.stack.append(item_id)
+            return
         g.log.debug('Starting testsuite %s', self.name)
-        self.service.start_test_item(
+        item_id = self.service.start_test_item(
             name=self.name,
             start_time=str(int(time.time() * 1000)),
             item_type=self.item_type)
+        if self.journal is not None:
+            self.journal.item_started(self.position, item_id,
+                                      after=pending(self.service))
 
     def finish(self):
         """Finish a testsuite section in ReportPortal"""
+        if self.journal is not None and \
+                self.position in self.journal.finished:
+            self.service.stack.pop()
+            return
+        # a file suite only knows its status once its testsuites are in
+        self.status = self.testsuite.status
         self.service.finish_test_item(end_time=str(int(time.time() * 1000)),
                                       status=self.status)
+        if self.journal is not None:
+            self.journal.item_finished(self.position,
+                                       after=pending(self.service))
         g.log.debug('Finished testsuite %s', self.name)
 
 
 class TestCase:
     """Class to handle xUnit TestCase conversion to ReportPortal API calls"""
-    def __init__(self, rportal, xml_name, testcase, configs=None):
+    def __init__(self, rportal, xml_name, testcase, configs=None,
+                 attachment_index=None):
+        if not isinstance(testcase, TestCaseRecord):
+            testcase = TestCaseRecord.from_dict(testcase)
         self.service = rportal.service
         self.xml_name = xml_name
         self.testcase = testcase
         self._configs = configs
-        self.tc_classname = testcase.get('@classname', '')
-        self.tc_name = testcase.get('@name', testcase.get('@id', None))
-        self.tc_time = testcase.get('@time')
+        self.attachment_index = attachment_index
+        self.tc_classname = testcase.classname
+        self.tc_name = testcase.name
+        # as written in the file, the float is only for the statistics
+        self.tc_time = testcase.time_text
         #self.tc_attach_dir = '{}.{}'.format(self.tc_classname, self.tc_name)
         self.description = '{} time: {}'.format(self.tc_name, self.tc_time)
-        self.status = 'PASSED'
+        self.status = testcase.status
         self.issue = None
-        self.rplog = RpLog(rportal)
+        if self.status == 'SKIPPED':
+            self.issue = {"issue_type": "NOT_ISSUE"}
+        self.rplog = rportal.rplog
+        self.logs = None
+        self.attachments = None
+        self.journal = None
+        self.position = None
 
-    def start(self):
-        """Start a testcase in ReportPortal"""
-        #g.log.debug('.', end='', flush=True)
-        self.service.start_test_item(name=self.tc_name[:255],
-                                     description=self.description,
-                                     tags=['testtag1'],
-                                     start_time=str(int(time.time() * 1000)),
-                                     item_type='STEP')
-
-        # Add system_out log.
-        if self.testcase.get('system-out'):
-            self.rplog.add_message(message=self.testcase.get('system-out'),
-                                   level="INFO")
+    def bind(self, rportal):
+        """Report through the service of another ReportPortal instance"""
+        self.service = rportal.service
+        self.rplog = rportal.rplog
 
-        # Indicate type of test case (skipped, failures, passed)
-        if self.testcase.get('skipped'):
-            self.issue = {"issue_type": "NOT_ISSUE"}
-            self.status = 'SKIPPED'
-            skipped_case = self.testcase.get('skipped')
-            msg = skipped_case.get('@message', '#text') \
-                if isinstance(skipped_case, dict) else skipped_case
-            self.rplog.add_message(message=msg, level="DEBUG")
-        elif self.testcase.get('failure') or self.testcase.get('error'):
-            self.status = 'FAILED'
-            failures = self.testcase.get('failure',
-                                         self.testcase.get('error'))
-            failures_txt = ""
-            if isinstance(failures, list):
-                for failure in failures:
-                    msg = failure.get('@message', failure.get('#text')) \
-                        if isinstance(failure, dict) else failure
-                    failures_txt += \
-                        '{msg}\n'.format(msg=msg)
-            else:
-                failures_txt = failures.get('@message', failures.get('#text'))\
-                    if isinstance(failures, dict) else failures
+    def track(self, journal, position):
+        """Record progress in an ImportJournal (and skip what it has)"""
+        self.journal = journal
+        self.position = position
+
+    def prepare(self):
+        """Collect the log messages and attachments for this testcase"""
+        self.logs = []
+        self.attachments = []
 
-            self.rplog.add_message(message=failures_txt, level="ERROR")
+        # Add system_out and system_err logs, large ones were spilled to a
+        # file by the parser and are attached with an excerpt logged
+        for output, level in ((self.testcase.system_out, "INFO"),
+                              (self.testcase.system_err, "WARN")):
+            if isinstance(output, SpilledOutput):
+                self.logs.append((output.excerpt(), level))
+                self.attachments.append(output.path)
+            elif output:
+                self.logs.append((output, level))
+
+        # Indicate type of test case (skipped, failures, passed)
+        if self.status == 'SKIPPED':
+            self.logs.append((self.testcase.message, "DEBUG"))
+        elif self.status == 'FAILED':
+            self.logs.append((self.testcase.message, "ERROR"))
 
             # handle attachments
             tc_attach_dir = '{}.{}'.format(self.tc_classname,
                                            self.tc_name)
-            fqpath = os.path.join(self._configs.payload_dir, 'attachments')
-            self.rplog.add_attachments(fqpath, self.xml_name, tc_attach_dir)
+            if self.attachment_index is not None:
+                self.attachments.extend(self.attachment_index.get(
+                    self.xml_name, tc_attach_dir))
+            else:
+                fqpath = os.path.join(self._configs.payload_dir,
+                                      'attachments')
+                self.attachments.extend(RpLog.get_attachments(
+                    fqpath, self.xml_name, tc_attach_dir))
+
+    def start(self):
+        """Start a testcase in ReportPortal"""
+        if self.logs is None:
+            self.prepare()
+
+        item_id = None
+        if self.journal is not None:
+            item_id = self.journal.started.get(self.position)
+        if item_id is not None:
+            # started by an interrupted run, send the logs again
+            self.service.stack.append(item_id)
         else:
-            self.status = 'PASSED'
+            #g.log.debug('.', end='', flush=True)
+            item_id = self.service.start_test_item(
+                name=self.tc_name[:255], description=self.description,
+                tags=['testtag1'], start_time=str(int(time.time() * 1000)),
+                item_type='STEP')
+            if self.journal is not None:
+                self.journal.item_started(self.position, item_id,
+                                          after=pending(self.service))
+
+        for message, level in self.logs:
+            self.rplog.add_message(message=message, level=level)
+
+        self.rplog.add_testcase_attachments(self.attachments)
 
     def finish(self):
         """Finish a testcase in ReportPortal"""
-        self.service.finish_test_item(end_time=str(int(time.time() * 1000)),
-                                      status=self.status,
-                                      issue=self.issue)
+        finished = None
+        if self.journal is not None and \
+                self.position in self.journal.finished:
+            self.service.stack.pop()
+        else:
+            self.service.finish_test_item(
+                end_time=str(int(time.time() * 1000)), status=self.status,
+                issue=self.issue)
+            if self.journal is not None:
+                finished = pending(self.service)
+                self.journal.item_finished(self.position, after=finished)
+        if self.journal is not None:
+            # a resumed run skips logged testcases, so their finish must
+            # be done too
+            position = self.position
+            self.rplog.on_sent(lambda: self.journal.item_logged(
+                position, after=finished))
 
 # TODO: set actual status from xml data
+
+
+class PassedSummary(TestCase):
+    """One item standing in for the passed testcases of a testsuite.
+
+    The count and total time go into the item and its log, the names and
+    times of the testcases into a gzipped tab separated attachment written
+    as they are counted. A green testsuite then takes a handful of calls
+    instead of two or more per testcase.
+    """
+    def __init__(self, rportal, xml_name, suite_name, tmp_dir, configs=None):
+        super().__init__(rportal, xml_name,
+                         TestCaseRecord('passed testcases',
+                                        classname=suite_name),
+                         configs=configs)
+        self.tmp_dir = tmp_dir
+        self.count = 0
+        self.total_time = 0.0
+        self.list_path = None
+        self._listfd = None
+
+    def add(self, testcase):
+        """Count a passed testcase (a TestCaseRecord) and write it to the
+        name list"""
+        if self._listfd is None:
+            self.list_path = os.path.join(tempfile.mkdtemp(dir=self.tmp_dir),
+                                          'passed_testcases.gz')
+            self._listfd = gzip.open(self.list_path, 'wt')
+            self._listfd.write('classname\tname\ttime\n')
+        self._listfd.write('{}\t{}\t{}\n'.format(
+            testcase.classname, testcase.name,
+            '' if testcase.time_text is None else testcase.time_text))
+        self.count += 1
+        self.total_time += testcase.time or 0.0
+
+    def close(self):
+        """Finish the name list"""
+        if self._listfd is not None:
+            self._listfd.close()
+            self._listfd = None
+
+    def prepare(self):
+        """Finish the name list and write the summary message"""
+        self.close()
+        self.tc_name = '{} passed testcases'.format(self.count)
+        self.tc_time = round(self.total_time, 3)
+        self.description = '{} time: {}'.format(self.tc_name, self.tc_time)
+        self.logs = [('{} testcases of {} passed in {}s, see '
+                      'passed_testcases.gz for the list'.format(
+                          self.count, self.tc_classname, self.tc_time),
+                      'INFO')]
+        self.attachments = [self.list_path]
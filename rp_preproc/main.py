@@ -71,7 +71,24 @@ def run(args):
                 rp_preproc_api = (preproc.configs.service_url +
                                   'api/v1/process/payload/')
                 data = {'simple_xml': preproc.configs.simple_xml,
+                        'stream_xml': preproc.configs.stream_xml,
+                        'jobs': preproc.configs.jobs,
+                        'shards': preproc.configs.shards,
+                        'pipeline': preproc.configs.pipeline,
+                        'preflight': preproc.configs.preflight,
+                        'durations_description':
+                            preproc.configs.durations_description,
+                        'results_include': preproc.configs.results_include,
+                        'results_exclude': preproc.configs.results_exclude,
+                        'results_max_depth':
+                            preproc.configs.results_max_depth,
+                        'queue_size': preproc.configs.queue_size,
+                        'output_spill_size':
+                            preproc.configs.output_spill_size or 0,
+                        'compact_passed': preproc.configs.compact_passed,
+                        'resume': preproc.configs.resume,
                         'merge_launches': preproc.configs.merge_launches,
+                        'single_launch': preproc.configs.single_launch,
                         'auto_dashboard': preproc.configs.auto_dashboard,
                         'debug': preproc.configs.debug}
                 response = payload.send(rp_preproc_api, data=data)
@@ -91,6 +108,8 @@ def run(args):
         rp_response = preproc.process()
 
         rp_return_code = 0
+        if not rp_response.get('preflight', {}).get('valid', True):
+            rp_return_code = 1
 
     import_finish_time = int(time.time())
     time_elapsed = import_finish_time - import_start_time
@@ -108,6 +127,50 @@ def run(args):
     return rp_return_code
 
 
+def replay(argv):
+    """Send spooled launches to ReportPortal (rp_preproc replay ...)"""
+    parser = argparse.ArgumentParser(prog="rp_preproc replay",
+                                     description=("Send launches spooled "
+                                                  "with --spool to "
+                                                  "ReportPortal"),
+                                     epilog="Red Hat QE CCIT")
+    parser.add_argument("spool_dir",
+                        help="Spool directory given to --spool")
+    parser.add_argument("-c", "--config",
+                        help="RP PreProc config file",
+                        action="store", dest="config_file",
+                        default=None, required=True)
+    parser.add_argument("-w", "--workers",
+                        help="Number of operations sent in parallel",
+                        action="store", dest="workers", type=int,
+                        default=8)
+    parser.add_argument("-l", "--log",
+                        help=("Filepath for logfile"),
+                        action="store", dest="log_filepath",
+                        default='/tmp/rp_preproc.log')
+    parser.add_argument("--merge",
+                        help="Merge multiple launches into one.",
+                        action="store_true", dest="merge_launches",
+                        default=None)
+    parser.add_argument("--debug",
+                        help="Display debug info in log and stdout",
+                        action="store_true", dest="debug")
+    args = parser.parse_args(argv)
+
+    g.set_log_level('glustolog', 'glustolog1', 'INFO')
+    if args.log_filepath is not None:
+        g.set_log_filename('glustolog', 'glustolog1', args.log_filepath)
+    if args.debug:
+        g.set_log_level('glustolog', 'glustolog1', 'DEBUG')
+
+    preproc = PreProcClient(vars(args))
+    rp_response = preproc.replay(args.spool_dir, workers=args.workers)
+    print(json.dumps({"reportportal": rp_response}, indent=2,
+                     sort_keys=True))
+
+    return 0
+
+
 def main():
     """Entry point console script for setuptools.
     Provides a command-line interface to rp-preproc.
@@ -117,7 +180,12 @@ def main():
             -d resources/examples/myresults_example \
             --service http://rp-preproc.example.com:8080/ \
             --merge
+
+        $ rp_preproc replay -c rp_preproc_conf.json /var/spool/rp_preproc
     """
+    if sys.argv[1:2] == ['replay']:
+        return replay(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description="ReportPortal client",
                                      epilog="Red Hat QE CCIT")
     parser.add_argument("-c", "--config",
@@ -141,10 +209,94 @@ def main():
                         help="Send xml without preprocessing",
                         action="store_true", dest="simple_xml",
                         default=None)
+    parser.add_argument("--include",
+                        help=("Glob pattern of result file names to import "
+                              "(can be repeated)"),
+                        action="append", dest="results_include",
+                        default=None)
+    parser.add_argument("--exclude",
+                        help=("Glob pattern of files or directories under "
+                              "results to skip (can be repeated)"),
+                        action="append", dest="results_exclude",
+                        default=None)
+    parser.add_argument("--max-depth",
+                        help="Levels of subdirectories of results to search",
+                        action="store", dest="results_max_depth", type=int,
+                        default=None)
+    parser.add_argument("--cache-dir",
+                        help=("Directory caching parsed result files so "
+                              "re-runs skip parsing"),
+                        action="store", dest="cache_dir",
+                        default=None)
+    parser.add_argument("--no-preflight",
+                        help=("Skip checking all result files before "
+                              "starting any launch"),
+                        action="store_false", dest="preflight",
+                        default=None)
+    parser.add_argument("--stream",
+                        help=("Parse and import xml incrementally to keep "
+                              "memory use flat on very large files"),
+                        action="store_true", dest="stream_xml",
+                        default=None)
+    parser.add_argument("-j", "--jobs",
+                        help="Number of result files to import in parallel",
+                        action="store", dest="jobs", type=int,
+                        default=None)
+    parser.add_argument("--shards",
+                        help=("Number of workers reporting the testcases "
+                              "of a single testsuite in parallel"),
+                        action="store", dest="shards", type=int,
+                        default=None)
+    parser.add_argument("--pipeline",
+                        help=("Run parsing, transforming and uploading as "
+                              "concurrent stages"),
+                        action="store_true", dest="pipeline",
+                        default=None)
+    parser.add_argument("--queue-size",
+                        help="Maximum items queued between pipeline stages",
+                        action="store", dest="queue_size", type=int,
+                        default=None)
+    parser.add_argument("--output-spill-size",
+                        help=("Characters of a system-out/system-err "
+                              "logged before it is sent as a compressed "
+                              "attachment instead (0 to disable)"),
+                        action="store", dest="output_spill_size", type=int,
+                        default=None)
+    parser.add_argument("--durations-description",
+                        help=("Add a test duration summary to the launch "
+                              "description"),
+                        action="store_true", dest="durations_description",
+                        default=None)
+    parser.add_argument("--compact-passed",
+                        help=("Report the passed testcases of each testsuite "
+                              "as one summary item"),
+                        action="store_true", dest="compact_passed",
+                        default=None)
+    parser.add_argument("--spool",
+                        help=("Write the ReportPortal operations to this "
+                              "directory for 'rp_preproc replay' instead of "
+                              "sending them"),
+                        action="store", dest="spool_dir",
+                        default=None)
+    parser.add_argument("--journal-dir",
+                        help=("Keep a checkpoint journal of every import "
+                              "in this directory"),
+                        action="store", dest="journal_dir",
+                        default=None)
+    parser.add_argument("--resume",
+                        help=("Continue interrupted imports from their "
+                              "journals instead of starting over"),
+                        action="store_true", dest="resume",
+                        default=None)
     parser.add_argument("--merge",
                         help="Merge multiple launches into one.",
                         action="store_true", dest="merge_launches",
                         default=None)
+    parser.add_argument("--single-launch",
+                        help=("Import all result files into one launch, "
+                              "each file as a top-level suite"),
+                        action="store_true", dest="single_launch",
+                        default=None)
     parser.add_argument("--auto-dashboard",
                         help=("Automatically create a dashboard "
                               "with basic filter and widget"),
@@ -1,3 +1,5 @@
+import os
+
 # Flask settings
 FLASK_DEBUG = False  # Do not use debug mode in production
 
@@ -6,3 +8,11 @@ RESTPLUS_SWAGGER_UI_DOC_EXPANSION = 'list'
 RESTPLUS_VALIDATE = True
 RESTPLUS_MASK_SWAGGER = False
 RESTPLUS_ERROR_404_HELP = False
+
+# ReportPortal budget shared by all service workers, per endpoint and
+# project (no limit when neither is set)
+RATE_LIMIT_DB = os.environ.get('RP_PREPROC_RATE_LIMIT_DB',
+                               '/tmp/rp_preproc_ratelimit.sqlite')
+RATE_LIMIT_RPS = os.environ.get('RP_PREPROC_RATE_LIMIT_RPS', None)
+RATE_LIMIT_CONCURRENT = os.environ.get('RP_PREPROC_RATE_LIMIT_CONCURRENT',
+                                       None)
@@ -41,7 +41,9 @@ setup(
             ]
                 },
     install_requires=['flask-restplus==0.9.2', 'gunicorn==19.8.*',
-                      'xmltodict', 'reportportal_client',
+                      'numpy', 'reportportal_client',
                       ('glusto@git+git://github.com/loadtheaccumulator/'
                        'glusto.git@python3_port4#egg=glusto')],
+    extras_require={'asyncio': ['aiohttp'],
+                    'test': ['pytest', 'xmltodict']},
 )
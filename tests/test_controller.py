@@ -0,0 +1,100 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""RequestController retry rules"""
+import pytest
+
+from rp_preproc.libs.controller import RequestController
+
+
+class Response:
+    """Just enough of a requests.Response"""
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.url = 'http://rp.example.com/api/v1/project/item'
+
+
+def _sender(*outcomes):
+    """send() giving the outcomes in turn (a status or an exception)"""
+    calls = []
+
+    def send():
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome)
+
+    return send, calls
+
+
+@pytest.fixture
+def controller():
+    return RequestController(retries=3, backoff=0)
+
+
+@pytest.mark.parametrize('status', [500, 502, 504])
+def test_post_not_retried_on_server_error(controller, status):
+    send, calls = _sender(status, 201)
+
+    assert controller.call(send, method='POST').status_code == status
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_post_retried_when_throttled(controller, status):
+    send, calls = _sender(status, 201)
+
+    assert controller.call(send, method='POST').status_code == 201
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('method', ['PUT', None])
+def test_idempotent_retried_on_server_error(controller, method):
+    send, calls = _sender(502, 200)
+
+    assert controller.call(send, method=method).status_code == 200
+    assert len(calls) == 2
+
+
+def test_post_retried_when_unsent(controller):
+    send, calls = _sender(ConnectionError('refused'), 201)
+
+    response = controller.call(send, method='POST', unsent=lambda err: True)
+    assert response.status_code == 201
+    assert len(calls) == 2
+
+
+def test_post_not_retried_when_maybe_sent(controller):
+    send, calls = _sender(TimeoutError('read timed out'), 201)
+
+    with pytest.raises(TimeoutError):
+        controller.call(send, method='POST', unsent=lambda err: False)
+    assert len(calls) == 1
+
+    send, calls = _sender(ConnectionError('reset'), 201)
+    with pytest.raises(ConnectionError):
+        controller.call(send, method='POST')
+    assert len(calls) == 1
+
+
+def test_gives_up_after_retries(controller):
+    send, calls = _sender(503, 503, 503, 503, 201)
+
+    assert controller.call(send, method='POST').status_code == 503
+    assert len(calls) == 4
+    assert controller.stats['failed'] == 1
+    assert controller.stats['in_flight'] == 0
@@ -0,0 +1,94 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""ImportJournal recovery and resume"""
+from concurrent.futures import Future
+import json
+
+from rp_preproc.libs.journal import ImportJournal
+
+KEY = 'abc123'
+
+
+def _write_run(journal_dir):
+    journal = ImportJournal(journal_dir, KEY)
+    journal.launch_started('launch-1')
+    journal.item_started(0, 'suite-1')
+    journal.item_started(1, 'case-1')
+    journal.item_finished(1)
+    journal.item_logged(1)
+    journal.close()
+
+    return journal.filename
+
+
+def test_resume_state(tmpdir):
+    _write_run(str(tmpdir))
+    journal = ImportJournal(str(tmpdir), KEY, resume=True)
+
+    assert journal.resuming
+    assert journal.launch_id == 'launch-1'
+    assert journal.started == {0: 'suite-1', 1: 'case-1'}
+    assert journal.finished == {1}
+    assert journal.logged == {1}
+    assert not journal.launch_finished
+    journal.close()
+
+
+def test_torn_record_is_dropped(tmpdir):
+    filename = _write_run(str(tmpdir))
+    with open(filename, 'a') as journalfd:
+        journalfd.write('{"op":"start","pos":2,"id":"ca')
+
+    journal = ImportJournal(str(tmpdir), KEY, resume=True)
+    assert journal.started == {0: 'suite-1', 1: 'case-1'}
+    journal.item_started(2, 'case-2')
+    journal.launch_done()
+    journal.close()
+
+    with open(filename) as journalfd:
+        records = [json.loads(line) for line in journalfd]
+    assert records[-2:] == [{'op': 'start', 'pos': 2, 'id': 'case-2'},
+                            {'op': 'launch_finish'}]
+
+    journal = ImportJournal(str(tmpdir), KEY, resume=True)
+    assert journal.started[2] == 'case-2'
+    assert journal.launch_finished
+    journal.close()
+
+
+def test_without_resume_starts_over(tmpdir):
+    _write_run(str(tmpdir))
+    journal = ImportJournal(str(tmpdir), KEY)
+
+    assert not journal.resuming
+    assert journal.started == {}
+    journal.close()
+
+
+def test_record_waits_for_request(tmpdir):
+    journal = ImportJournal(str(tmpdir), KEY)
+    sent, failed = Future(), Future()
+    journal.item_finished(1, after=sent)
+    journal.item_finished(2, after=failed)
+    assert journal.finished == set()
+
+    sent.set_result(None)
+    failed.set_exception(OSError('connection reset'))
+    journal.close()
+
+    journal = ImportJournal(str(tmpdir), KEY, resume=True)
+    assert journal.finished == {1}
+    journal.close()
@@ -0,0 +1,87 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""TestResults column store round trip"""
+import pickle
+
+from rp_preproc.libs import results as rp_results
+from rp_preproc.libs.results import SpilledOutput, StringTable, SuiteRecord
+
+
+def _events():
+    testcase = rp_results.TestCaseRecord
+    spilled = SpilledOutput('system-out', '/tmp/out.txt.gz', 10,
+                            'head', 'tail')
+    return [
+        ('testsuite', SuiteRecord('outer', failures=1)),
+        ('testcase', testcase('passes', classname='pkg.A', time=0.01,
+                              time_text='0.010')),
+        ('testsuite', SuiteRecord('inner')),
+        ('testcase', testcase('fails', classname='pkg.A', time=None,
+                              time_text='bad', status='FAILED',
+                              message='boom', system_out=spilled,
+                              system_err='err')),
+        ('testsuite_end', None),
+        ('testcase', testcase('skipped', status='SKIPPED')),
+        ('testsuite_end', None),
+    ]
+
+
+def _fields(event):
+    kind, record = event
+    if record is None:
+        return kind, None
+    fields = {}
+    for name in record.__slots__:
+        value = getattr(record, name)
+        if isinstance(value, SpilledOutput):
+            value = (value.name, value.path, value.size, value.head,
+                     value.tail)
+        fields[name] = value
+
+    return kind, fields
+
+
+def test_round_trip():
+    results = rp_results.TestResults.from_events(_events())
+
+    assert len(results) == 3
+    assert results.spilled == 1
+    assert [_fields(event) for event in results.events()] == \
+        [_fields(event) for event in _events()]
+
+
+def test_testcases_belong_to_open_suite():
+    results = rp_results.TestResults.from_events(_events())
+
+    assert list(results.suite_index) == [0, 1, 0]
+
+
+def test_pickle():
+    results = rp_results.TestResults.from_events(_events())
+    loaded = pickle.loads(pickle.dumps(results))
+
+    assert [_fields(event) for event in loaded.events()] == \
+        [_fields(event) for event in _events()]
+
+
+def test_interned_strings_after_pickle():
+    strings = pickle.loads(pickle.dumps(StringTable()))
+    first = strings.add('pkg.A', intern=True)
+
+    assert strings.add('pkg.A', intern=True) == first
+    assert strings.add('pkg.A') != first
+    assert strings.add(None) == -1
+    assert strings.get(-1) is None
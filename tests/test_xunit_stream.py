@@ -0,0 +1,104 @@
+# Copyright 2019 Red Hat QE CCIT
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software. If not, see <http://www.gnu.org/licenses/>.
+#
+"""XunitStream gives the records the xmltodict based parser gave"""
+import io
+
+import pytest
+
+from rp_preproc.libs import results as rp_results
+from rp_preproc.libs.xunit_stream import XunitStream
+
+xmltodict = pytest.importorskip('xmltodict')
+
+XUNIT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+  <testsuite name="suite one" failures="2" errors="1">
+    <testcase classname="pkg.One" name="passes" time="0.010"/>
+    <testcase classname="pkg.One" name="fails" time="1.5">
+      <failure message="assert 1 == 2">Traceback
+  line two</failure>
+      <system-out>some output</system-out>
+      <system-err>  padded error  </system-err>
+    </testcase>
+    <testcase classname="pkg.One" name="fails twice" time="2">
+      <failure message="first"/>
+      <failure>second, text only</failure>
+    </testcase>
+    <testcase classname="pkg.One" name="errors" time="bad">
+      <error type="OSError">no message attribute</error>
+    </testcase>
+    <testcase classname="pkg.One" name="skipped">
+      <skipped/>
+    </testcase>
+    <testcase classname="pkg.One" name="skipped with reason">
+      <skipped message="not today"/>
+    </testcase>
+  </testsuite>
+  <testsuite id="suite-two">
+    <testcase id="by id" time="3"/>
+    <testcase classname="pkg.Two" name="nested output">
+      <system-out>text <b>bold</b> tail</system-out>
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _xmltodict_records():
+    suites = xmltodict.parse(XUNIT)['testsuites']['testsuite']
+
+    return [(rp_results.SuiteRecord.from_dict(suite),
+             [rp_results.TestCaseRecord.from_dict(testcase)
+              for testcase in _as_list(suite['testcase'])])
+            for suite in suites]
+
+
+def _stream_records():
+    suites = []
+    for event, record in XunitStream(io.BytesIO(XUNIT), chunk_size=64):
+        if event == 'testsuite':
+            suites.append((record, []))
+        elif event == 'testcase':
+            suites[-1][1].append(record)
+
+    return suites
+
+
+def _fields(record):
+    return {name: getattr(record, name) for name in record.__slots__}
+
+
+def test_parity_with_xmltodict():
+    expected = _xmltodict_records()
+    parsed = _stream_records()
+
+    assert len(parsed) == len(expected)
+    for (suite, testcases), (want_suite, want_testcases) in zip(parsed,
+                                                                 expected):
+        assert _fields(suite) == _fields(want_suite)
+        assert [_fields(tc) for tc in testcases] == \
+            [_fields(tc) for tc in want_testcases]
+
+
+def test_event_order():
+    events = [event for event, _ in XunitStream(io.BytesIO(XUNIT))]
+
+    assert events == ['testsuite'] + ['testcase'] * 6 + ['testsuite_end'] + \
+        ['testsuite'] + ['testcase'] * 2 + ['testsuite_end']